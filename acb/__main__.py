@@ -1,19 +1,38 @@
 import argparse
 import os
+import sys
 
 from acb import extract_acb, name_gen_default
+from acb.stats import Stats
 
 def name_gen(track):
     print(track)
     return name_gen_default(track)
 
 def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--disarm-with", help="decrypt HCAs with provided keys")
+    if sys.argv[1:2] == ["batch"]:
+        from acb import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["serve"]:
+        from acb import server
+        sys.exit(server.main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(epilog="Use \"%(prog)s batch --help\" to extract many files at once, "
+        "or \"%(prog)s serve --help\" to serve tracks over HTTP.")
+    keys = parser.add_mutually_exclusive_group()
+    keys.add_argument("--disarm-with", help="decrypt HCAs with provided keys")
+    keys.add_argument("--keyring", metavar="PATH",
+        help="decrypt HCAs with whichever key fits from a file of keys, one per line")
     parser.add_argument("--awb", help="use file as the external AWB")
     parser.add_argument("--no-unmask", action="store_true", default=False,
-        help="don't unmask segment names (requires --disarm-with)")
+        help="don't unmask segment names (requires --disarm-with or --keyring)")
     parser.add_argument("--encoding", default=None, help="file's encoding")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="number of tracks to extract in parallel (default 1)")
+    parser.add_argument("--incremental", action="store_true", default=False,
+        help="only write tracks that changed since the last extraction into output_dir")
+    parser.add_argument("--stats-json", metavar="PATH", default=None,
+        help="write timings for each phase and track to PATH as JSON (- for stderr)")
     parser.add_argument("acb_file", help="input ACB file")
     parser.add_argument("output_dir", default=None, nargs="?",
         help="directory to place output files in (default next to the input file)")
@@ -25,8 +44,17 @@ def main():
         output_dir = os.path.dirname(args.acb_file) or os.getcwd()
 
     os.makedirs(output_dir, 0o755, exist_ok=True)
+    stats = Stats() if args.stats_json else None
     extract_acb(args.acb_file, output_dir, args.awb, args.disarm_with, name_gen=name_gen, 
-        no_unmask=args.no_unmask, encoding=args.encoding)
+        no_unmask=args.no_unmask, encoding=args.encoding, workers=args.jobs, incremental=args.incremental,
+        stats=stats, keyring=args.keyring)
+
+    if stats is not None:
+        if args.stats_json == "-":
+            print(stats.to_json(indent=1), file=sys.stderr)
+        else:
+            with open(args.stats_json, "w", encoding="utf-8") as f:
+                f.write(stats.to_json(indent=1))
 
 if __name__ == '__main__':
     main()
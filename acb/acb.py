@@ -43,16 +43,24 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
-import io
 import struct
 import itertools
+import mmap
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from collections import namedtuple as T
-from typing import Optional, Union, BinaryIO, Tuple, List, Callable
+from typing import Any, Dict, Iterable, Iterator, Optional, Union, BinaryIO, Tuple, List, Callable
 
-from .utf import UTFTable, R
-from .disarm import DisarmContext
+from .utf import UTFTable, FileWindow, make_reader, os_file_fd
+from .disarm import DisarmContext, disarm_backend
+from . import hca as _hca
+from .keyring import Keyring, load_keyring
+from .stats import Stats, phase as _phase
+from . import manifest as _manifest
+from . import sidecar as _sidecar
 
 WAVEFORM_ENCODE_TYPE_ADX          = 0
 WAVEFORM_ENCODE_TYPE_HCA          = 2
@@ -70,18 +78,18 @@ wave_type_ftable = {
     WAVEFORM_ENCODE_TYPE_NINTENDO_DSP : ".dsp"}
 
 track_t = T("track_t", ("cue_id", "name", "memory_wav_id", "external_wav_id", "enc_type", "is_stream"))
+# hca is an acb.hca.hca_info_t, or None.
+track_probe_t = T("track_probe_t", ("track", "hca"))
 
 class TrackList(object):
     def __init__(self, utf):
-        cue_handle = io.BytesIO(utf.rows[0]["CueTable"])
-        nam_handle = io.BytesIO(utf.rows[0]["CueNameTable"])
-        wav_handle = io.BytesIO(utf.rows[0]["WaveformTable"])
-        syn_handle = io.BytesIO(utf.rows[0]["SynthTable"])
-
-        cues = UTFTable(cue_handle, encoding=utf.encoding)
-        nams = UTFTable(nam_handle, encoding=utf.encoding)
-        wavs = UTFTable(wav_handle, encoding=utf.encoding)
-        syns = UTFTable(syn_handle, encoding=utf.encoding)
+        # Nested tables are parsed straight out of the buffers the outer
+        # table gives us, no need to wrap them in a BytesIO.
+        # Only a handful of columns are used, so let the tables read them lazily.
+        cues = UTFTable(utf.rows[0]["CueTable"], encoding=utf.encoding, lazy=True)
+        nams = UTFTable(utf.rows[0]["CueNameTable"], encoding=utf.encoding, lazy=True)
+        wavs = UTFTable(utf.rows[0]["WaveformTable"], encoding=utf.encoding, lazy=True)
+        syns = UTFTable(utf.rows[0]["SynthTable"], encoding=utf.encoding, lazy=True)
 
         self.tracks: List[track_t] = []
 
@@ -106,6 +114,13 @@ class TrackList(object):
             self.tracks.append(track_t(row["CueId"], name_map.get(ind, "UNKNOWN"), wav_id,
                 extern_wav_id, enc, is_stream))
 
+    @classmethod
+    def from_tracks(cls, tracks: Iterable[track_t]) -> "TrackList":
+        """ Make a TrackList out of already known tracks, e.g. from an index. """
+        self = cls.__new__(cls)
+        self.tracks = list(tracks)
+        return self
+
 def align(n):
     def _align(number):
         return (number + n - 1) & ~(n - 1)
@@ -114,9 +129,10 @@ def align(n):
 afs2_file_ent_t = T("afs2_file_ent_t", ("cue_id", "offset", "size"))
 
 class AFSArchive(object):
-    def __init__(self, file: BinaryIO, *, encoding: Optional[str] = None):
+    def __init__(self, file: Union[BinaryIO, bytes, memoryview, mmap.mmap], *, encoding: Optional[str] = None):
         # Note: we don't do anything involving strings here so encoding is not actually required
-        buf = R(file, encoding=encoding or "utf-8")
+        # If file is a buffer, track data is handed out as memoryview slices of it.
+        buf = make_reader(file, encoding=encoding or "utf-8")
 
         magic = buf.uint32_t()
         if magic != 0x41465332:
@@ -143,6 +159,25 @@ class AFSArchive(object):
         self.files: List[afs2_file_ent_t] = []
         self.create_file_entries(buf, file_count, cue_id_size, self.offset_size, self.offset_mask)
         self.src = buf
+        # R reads are seek + read on a shared file object; don't let threads interleave them.
+        # PR and BufferR don't have that problem.
+        self.lock = None if buf.threadsafe else threading.Lock()
+
+    @classmethod
+    def from_entries(cls, file: Union[BinaryIO, bytes, memoryview, mmap.mmap], files: Iterable[Iterable[int]],
+            alignment: int, mix_key: Optional[int], offset_size: int, *, encoding: Optional[str] = None) -> "AFSArchive":
+        """ Make an AFSArchive over file using already known entries (e.g.
+            from an index), without reading the archive's header. """
+        self = cls.__new__(cls)
+        self.alignment = alignment
+        self.mix_key = mix_key
+        self.offset_size = offset_size
+        self.offset_mask = int("FF" * offset_size, 16)
+        self.files = [afs2_file_ent_t(*f) for f in files]
+        self.build_index()
+        self.src = make_reader(file, encoding=encoding or "utf-8")
+        self.lock = None if self.src.threadsafe else threading.Lock()
+        return self
 
     def _struct_format(self, size):
         if size == 2:
@@ -168,18 +203,57 @@ class AFSArchive(object):
             zip(aligned_offs, offsets_for_length_calculating))
 
         self.files = list(itertools.starmap(afs2_file_ent_t, zip(cue_ids, aligned_offs, lengths)))
+        self.build_index()
 
-    def file_data_for_cue_id(self, cue_id, rw=False):
+    def build_index(self):
+        # Cue IDs should be unique, but if they aren't, the first entry wins
+        # (same as the linear search this replaced).
+        self.index: Dict[int, afs2_file_ent_t] = {}
         for f in self.files:
-            if f.cue_id == cue_id:
-                if rw:
-                    buf = bytearray(f.size)
-                    self.src.bytesinto(buf, at=f.offset)
-                    return buf
-                else:
-                    return self.src.bytes(f.size, at=f.offset)
+            self.index.setdefault(f.cue_id, f)
+
+    def entry_for_cue_id(self, cue_id: int) -> afs2_file_ent_t:
+        try:
+            return self.index[cue_id]
+        except KeyError:
+            raise ValueError("id {0} not found in archive".format(cue_id)) from None
+
+    def entries_for_cue_ids(self, cue_ids: Iterable[int]) -> List[afs2_file_ent_t]:
+        """ Look up many cue IDs at once. The entries are returned sorted by
+            offset, so reading them in order walks the archive front to back.
+            Each entry is returned once, even if its cue ID was requested more
+            than once. ValueError is raised if any cue ID is missing.
+        """
+        entries = {self.entry_for_cue_id(cue_id) for cue_id in cue_ids}
+        return sorted(entries, key=lambda f: f.offset)
+
+    def file_data_for_entry(self, f: afs2_file_ent_t, rw=False):
+        return self.file_data_range(f, 0, f.size, rw)
+
+    def file_data_range(self, f: afs2_file_ent_t, start: int, size: int, rw=False):
+        """ Read part of a file. Reads past the end of the file are truncated. """
+        size = max(0, min(size, f.size - start))
+        if self.lock is None:
+            return self._read(f.offset + start, size, rw)
+        with self.lock:
+            return self._read(f.offset + start, size, rw)
+
+    def _read(self, at: int, size: int, rw: bool):
+        if rw:
+            buf = bytearray(size)
+            self.src.bytesinto(buf, at=at)
+            return buf
         else:
-            raise ValueError("id {0} not found in archive".format(cue_id))
+            return self.src.bytes(size, at=at)
+
+    def file_data_for_cue_id(self, cue_id, rw=False):
+        return self.file_data_for_entry(self.entry_for_cue_id(cue_id), rw)
+
+    def file_data_for_cue_ids(self, cue_ids: Iterable[int], rw=False) -> Iterator[Tuple[afs2_file_ent_t, Any]]:
+        """ Yields (entry, data) for each of cue_ids, in the order given by
+            entries_for_cue_ids. """
+        for f in self.entries_for_cue_ids(cue_ids):
+            yield f, self.file_data_for_entry(f, rw)
 
 AnyFile = Union[str, os.PathLike, BinaryIO]
 Uninitialized = object()
@@ -190,6 +264,58 @@ def _get_file_obj(name: AnyFile) -> Tuple[BinaryIO, bool]:
     else:
         return name, False
 
+def _map_file(handle: BinaryIO) -> Optional[mmap.mmap]:
+    fd = os_file_fd(handle)
+    if fd is None:
+        return None
+
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty files and things like pipes can't be mapped.
+        return None
+
+def _unmap(m: Optional[mmap.mmap]):
+    if m is None:
+        return
+    try:
+        m.close()
+    except BufferError:
+        # Someone still holds a memoryview from get_track_data. The mapping
+        # will go away once they drop it.
+        pass
+
+def _kernel_copy(src_fd: int, offset: int, size: int, dst_fd: int) -> int:
+    """ Copy size bytes at offset in src_fd to the current position of
+        dst_fd without going through user space, using copy_file_range or
+        sendfile if the OS supports them for these files. Returns how many
+        bytes were copied, which may be fewer than asked for (even 0) if
+        neither works. """
+    copied = 0
+    for name in ("copy_file_range", "sendfile"):
+        call = getattr(os, name, None)
+        if call is None:
+            continue
+
+        try:
+            while copied < size:
+                if name == "copy_file_range":
+                    n = call(src_fd, dst_fd, size - copied, offset + copied)
+                else:
+                    n = call(dst_fd, src_fd, offset + copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            # Not supported for this pair of files (cross-device, not a
+            # regular file, old kernel...). Try the next method.
+            continue
+
+        if copied == size:
+            break
+
+    return copied
+
 class ACBFile(object):
     """ Represents an ACB file.
 
@@ -209,48 +335,177 @@ class ACBFile(object):
             not passed, we'll try reading it as Shift-JIS first (for backwards
             compatibility reasons), and then UTF-8, before giving up. If an 
             encoding is explicitly passed, only that encoding will be used. 
+        - use_mmap: Map the ACB and AWB files into memory instead of reading them.
+            Nested tables and track data are then sliced out of the mapping
+            without copying, and get_track_data returns a read-only memoryview
+            for tracks it doesn't need to decrypt. Files that can't be mapped
+            (e.g. BytesIO objects) are read normally.
+        - stats: A Stats object (see acb.stats) to record timings and byte
+            counts in, or None.
+        - metadata_only: Only read what's needed for track_list. extern_awb
+            isn't opened and trying to read track data raises ValueError.
+        - index: Path to a sidecar index file, or a directory to keep them in
+            (see acb.sidecar). If there is an up to date index for this ACB
+            (and AWB), the track list and AFS2 entries come from it and the
+            tables aren't parsed at all. Otherwise, the file is parsed as
+            usual and an index is written. acb_file (and extern_awb, if given)
+            must be paths.
+        - keyring: A Keyring (see acb.keyring), or the path to a keyring
+            file, to use instead of hca_keys when you don't know the key. The
+            key for each archive is picked the first time its tracks need
+            decrypting, and recorded in detected_keys. If none of the keys
+            fit, the archive's tracks aren't decrypted.
+
+        The AWB archives are only opened when track data is first requested
+        (see embedded_awb and external_awb). The embedded AWB is read in place
+        from the ACB, a window at a time, rather than being copied out.
     """
-    def __init__(self, acb_file: AnyFile, extern_awb: Optional[AnyFile] = None, hca_keys: Optional[str] = None, encoding: Optional[str] = None):
+    def __init__(self, acb_file: AnyFile, extern_awb: Optional[AnyFile] = None, hca_keys: Optional[str] = None, encoding: Optional[str] = None,
+            use_mmap: bool = False, stats: Optional[Stats] = None, metadata_only: bool = False,
+            index: Optional[str] = None, keyring: Optional[Union[str, Keyring]] = None):
+        # Enough for close() (and so __del__) to work if we give up early.
+        self.acb_handle_owned = self.awb_handle_owned = False
+        self.acb_map = self.awb_map = None
+
+        if hca_keys and keyring is not None:
+            raise ValueError("pass either hca_keys or keyring, not both")
+        if isinstance(keyring, (str, os.PathLike)):
+            keyring = load_keyring(keyring)
+
+        self.stats = stats
+        self.metadata_only = metadata_only
+        self.closed = False
+        self.archive_lock = threading.Lock()
+        self._embedded_awb: Optional[AFSArchive] = Uninitialized # type: ignore
+        self._external_awb: Optional[AFSArchive] = Uninitialized # type: ignore
+
+        self.index_path = None
+        record = None
+        if index is not None:
+            if not isinstance(acb_file, (str, os.PathLike)) or not isinstance(extern_awb, (str, os.PathLike, type(None))):
+                raise ValueError("index needs acb_file and extern_awb to be paths")
+            self.index_path = _sidecar.index_path(acb_file, index)
+            record = _sidecar.load_index(self.index_path, acb_file, extern_awb, encoding,
+                need_archives=not metadata_only)
+
         self.acb_handle, self.acb_handle_owned = _get_file_obj(acb_file)
         
-        if extern_awb is None:
+        if extern_awb is None or metadata_only:
             self.awb_handle = None
             self.awb_handle_owned = False
         else:
             self.awb_handle, self.awb_handle_owned = _get_file_obj(extern_awb)
 
-        self.encoding = encoding or "sjis"
-        try:
-            utf = UTFTable(self.acb_handle, encoding=encoding or "sjis")
-            self.track_list = TrackList(utf)
-        except UnicodeDecodeError:
-            if encoding is None:
-                self.encoding = "utf-8"
-                utf = UTFTable(self.acb_handle, encoding="utf-8")
-                self.track_list = TrackList(utf)
-            else:
-                raise
-
-        if len(utf.rows[0]["AwbFile"]) > 0:
-            self.embedded_awb = AFSArchive(io.BytesIO(utf.rows[0]["AwbFile"]), encoding=self.encoding)
-        else:
-            self.embedded_awb = None # type: ignore
-
-        if self.awb_handle:
-            self.external_awb = AFSArchive(self.awb_handle, encoding=self.encoding)
-        else:
-            self.external_awb = None # type: ignore
+        use_mmap = use_mmap and not metadata_only
+        self.acb_map = _map_file(self.acb_handle) if use_mmap else None
+        self.awb_map = _map_file(self.awb_handle) if use_mmap and self.awb_handle else None
+        acb_src = self.acb_map if self.acb_map is not None else self.acb_handle
 
+        self.acb_src = acb_src
         self.hca_keys = hca_keys
+        self.keyring = keyring
+        # Archive ("embedded_awb" or "external_awb") -> key picked from the keyring.
+        self.detected_keys: Dict[str, Optional[str]] = {}
         self.embedded_disarm: Optional[DisarmContext] = Uninitialized # type: ignore
         self.external_disarm: Optional[DisarmContext] = Uninitialized # type: ignore
-        
-        self.closed = False
+        self.archive_records: Dict[str, Any] = {}
+
+        if record is not None:
+            self.encoding = record["encoding"]
+            self.track_list = TrackList.from_tracks(track_t(*t) for t in record["tracks"])
+            self.embedded_awb_span = tuple(record["embedded_awb_span"])
+            self.archive_records = {k: record[k] for k in ("embedded_awb", "external_awb") if k in record}
+            return
+
+        self.encoding = encoding or "sjis"
+        with _phase(stats, "parse"):
+            try:
+                utf = UTFTable(acb_src, encoding=encoding or "sjis", lazy=True)
+                self.track_list = TrackList(utf)
+            except UnicodeDecodeError:
+                if encoding is None:
+                    self.encoding = "utf-8"
+                    utf = UTFTable(acb_src, encoding="utf-8", lazy=True)
+                    self.track_list = TrackList(utf)
+                else:
+                    raise
+
+        # Where the embedded AWB is in the ACB. Nothing is read from it yet.
+        self.embedded_awb_span = utf.data_span("AwbFile")
+
+        if self.index_path is not None:
+            record = {
+                "acb": _manifest.file_identity(acb_file),
+                "awb": _manifest.file_identity(extern_awb),
+                "encoding": self.encoding,
+                "embedded_awb_span": list(self.embedded_awb_span),
+                "tracks": [list(t) for t in self.track_list.tracks],
+            }
+            if not metadata_only:
+                record["embedded_awb"] = _sidecar.archive_record(self.embedded_awb)
+                record["external_awb"] = _sidecar.archive_record(self.external_awb)
+            _sidecar.save_index(self.index_path, record)
+
+    @property
+    def embedded_awb(self) -> Optional[AFSArchive]:
+        """ The AWB embedded in the ACB, or None. Opened on first use. """
+        if self._embedded_awb is Uninitialized:
+            self._open_archives()
+        return self._embedded_awb
+
+    @property
+    def external_awb(self) -> Optional[AFSArchive]:
+        """ The external (streaming) AWB, or None. Opened on first use. """
+        if self._external_awb is Uninitialized:
+            self._open_archives()
+        return self._external_awb
+
+    def _open_archives(self):
+        if self.closed:
+            raise ValueError("ACBFile is closed")
+        if self.metadata_only:
+            raise ValueError("ACBFile was opened with metadata_only=True, track data can't be read")
+
+        with self.archive_lock, _phase(self.stats, "index"):
+            if self._embedded_awb is Uninitialized:
+                offset, size = self.embedded_awb_span
+                if size == 0:
+                    src = None
+                elif isinstance(self.acb_src, (bytes, bytearray, memoryview, mmap.mmap)):
+                    src = memoryview(self.acb_src)[offset:offset + size]
+                else:
+                    src = FileWindow(self.acb_src, offset, size)
+                self._embedded_awb = self._open_archive(src, "embedded_awb")
+
+            if self._external_awb is Uninitialized:
+                self._external_awb = self._open_archive(
+                    self.awb_map if self.awb_map is not None else self.awb_handle, "external_awb")
+
+    def _open_archive(self, src, key: str) -> Optional[AFSArchive]:
+        if src is None:
+            return None
+
+        record = self.archive_records.get(key)
+        if record:
+            return AFSArchive.from_entries(src, record["files"], record["alignment"], record["mix_key"],
+                record["offset_size"], encoding=self.encoding)
+        return AFSArchive(src, encoding=self.encoding)
     
+    def _keys_for(self, archive: Optional[AFSArchive], name: str) -> Optional[str]:
+        if self.keyring is None or not archive:
+            return self.hca_keys
+
+        with _phase(self.stats, "key_table"):
+            key = self.keyring.detect(archive)
+        self.detected_keys[name] = key
+        return key
+
     def get_embedded_disarm(self) -> Optional[DisarmContext]:
         if self.embedded_disarm is Uninitialized:
-            if self.hca_keys and self.embedded_awb:
-                self.embedded_disarm = DisarmContext(self.hca_keys, self.embedded_awb.mix_key)
+            keys = self._keys_for(self.embedded_awb, "embedded_awb")
+            if keys and self.embedded_awb:
+                with _phase(self.stats, "key_table"):
+                    self.embedded_disarm = DisarmContext(keys, self.embedded_awb.mix_key)
             else:
                 self.embedded_disarm = None
 
@@ -258,41 +513,177 @@ class ACBFile(object):
     
     def get_external_disarm(self) -> Optional[DisarmContext]:
         if self.external_disarm is Uninitialized:
-            if self.hca_keys and self.external_awb:
-                self.external_disarm = DisarmContext(self.hca_keys, self.external_awb.mix_key)
+            keys = self._keys_for(self.external_awb, "external_awb")
+            if keys and self.external_awb:
+                with _phase(self.stats, "key_table"):
+                    self.external_disarm = DisarmContext(keys, self.external_awb.mix_key)
             else:
                 self.external_disarm = None
         return self.external_disarm
 
-    def get_track_data(self, track: track_t, disarm: Optional[bool] = None, unmask: bool = True) -> bytearray:
+    def get_track_data(self, track: track_t, disarm: Optional[bool] = None, unmask: bool = True) -> Union[bytearray, memoryview]:
         """ Gets encoded audio data as a bytearray.
 
             Arguments:
             - track: The track to get data for, from .track_list.
             - disarm: Whether to decrypt HCA data before returning it.
-                The default action is to decrypt if hca_keys were passed when creating
-                the ACBFile. You can pass False to skip decryption, or True to force
+                The default action is to decrypt if hca_keys (or a keyring) were passed
+                when creating the ACBFile. You can pass False to skip decryption, or True to force
                 decryption. 
                 ValueError is raised you force decryption and keys were not passed.
             - unmask: Whether to remove XOR masking from HCA header tags. 
                 This only has an effect if decryption is enabled, whether implicitly or
                 explicitly.
+
+            If the ACBFile was opened with use_mmap=True and the track doesn't need to be
+            decrypted, a read-only memoryview into the mapped file is returned instead.
         """
-        if self.closed:
-            raise ValueError("ACBFile is closed")
+        start = time.perf_counter()
+        archive, entry, disarmer, mapped = self._locate(track, disarm)
+        buf = self._read_track_data(archive, entry, disarmer, mapped, unmask)
+        self._track_done(track, start, entry.size, disarmer)
+        return buf
 
-        if track.is_stream:
-            if not self.external_awb:
-                raise ValueError("Track {0} is streamed, but there's no external AWB attached.".format(track))
+    def _read_track_data(self, archive, entry, disarmer, mapped, unmask):
+        with _phase(self.stats, "read", entry.size):
+            # Mapped archives can hand out the data without copying it.
+            buf = archive.file_data_for_entry(entry, rw=disarmer is not None or not mapped)
+
+        if disarmer:
+            with _phase(self.stats, "disarm", entry.size):
+                disarmer.disarm(buf, not unmask)
 
-            buf = self.external_awb.file_data_for_cue_id(track.external_wav_id, rw=True)
+        return buf
+
+    def _track_done(self, track, start, nbytes, disarmer):
+        if self.stats is not None:
+            self.stats.add_track(track.name, track.cue_id, time.perf_counter() - start, nbytes,
+                disarm_backend() if disarmer else None)
+
+    def write_track(self, track: track_t, out_file: BinaryIO, disarm: Optional[bool] = None, unmask: bool = True) -> int:
+        """ Write a track's data to out_file, a file object opened for writing
+            in binary mode. Takes the same arguments as get_track_data and
+            returns the number of bytes written.
+
+            Tracks that don't need to be decrypted and live in a real file
+            are copied by the kernel (copy_file_range or sendfile) where
+            possible, without being read into memory.
+        """
+        start = time.perf_counter()
+        archive, entry, disarmer, mapped = self._locate(track, disarm)
+
+        if not disarmer:
+            if track.is_stream:
+                src, base = self.awb_handle, 0
+            else:
+                src, base = self.acb_handle, self.embedded_awb_span[0]
+
+            src_fd, dst_fd = os_file_fd(src), os_file_fd(out_file)
+            if src_fd is not None and dst_fd is not None:
+                with _phase(self.stats, "write", entry.size):
+                    out_file.flush()
+                    copied = _kernel_copy(src_fd, base + entry.offset, entry.size, dst_fd)
+                    # Let the file object catch up with what was written behind its back.
+                    out_file.seek(os.lseek(dst_fd, 0, os.SEEK_CUR))
+                    if copied:
+                        # Whatever the kernel didn't get to. If the file is
+                        # truncated, this may come up short too.
+                        copied += out_file.write(archive.file_data_range(entry, copied, entry.size - copied))
+                if copied:
+                    self._track_done(track, start, entry.size, None)
+                    return copied
+
+        buf = self._read_track_data(archive, entry, disarmer, mapped, unmask)
+        with _phase(self.stats, "write", len(buf)):
+            written = out_file.write(buf)
+        self._track_done(track, start, entry.size, disarmer)
+        return written
+
+    def stream_track_data(self, track: track_t, disarm: Optional[bool] = None, unmask: bool = True,
+            blocks_per_chunk: int = 64, chunk_size: int = 0x40000) -> Iterator[Union[bytearray, memoryview]]:
+        """ Like get_track_data, but yields the track in pieces instead of
+            reading it all at once. For encrypted HCAs, the header comes first,
+            followed by groups of blocks_per_chunk blocks, each decrypted as it
+            is read. Anything else is read chunk_size bytes at a time.
+
+            Joining the pieces gives the same result as get_track_data. The
+            ACBFile must stay open until the iterator is exhausted.
+        """
+        return self._iter_track_data(*self._locate(track, disarm), unmask, blocks_per_chunk, chunk_size)
+
+    def _iter_track_data(self, archive, entry, disarmer, mapped, unmask, blocks_per_chunk, chunk_size):
+        pos = 0
+
+        if disarmer and entry.size >= 8:
+            header = archive.file_data_range(entry, 0, 8, rw=True)
+            header_size = struct.unpack(">H", header[6:8])[0]
+            header += archive.file_data_range(entry, 8, header_size - 8, rw=True)
+            layout = disarmer.disarm_header(header, not unmask)
+            yield header
+            pos = len(header)
+
+            if layout:
+                blocks_end = min(entry.size, pos + layout.block_count * layout.block_size)
+                while pos + layout.block_size <= blocks_end:
+                    count = min(blocks_per_chunk, (blocks_end - pos) // layout.block_size)
+                    buf = archive.file_data_range(entry, pos, count * layout.block_size, rw=True)
+                    disarmer.disarm_blocks(buf, 0, count, layout.block_size, layout.ciph_type)
+                    yield buf
+                    pos += len(buf)
+                if blocks_end - pos >= 2:
+                    # Truncated file: the last block is partial.
+                    buf = archive.file_data_range(entry, pos, blocks_end - pos, rw=True)
+                    disarmer.disarm_blocks(buf, 0, 1, layout.block_size, layout.ciph_type)
+                    yield buf
+                    pos += len(buf)
+
+        while pos < entry.size:
+            buf = archive.file_data_range(entry, pos, chunk_size, rw=not mapped)
+            yield buf
+            pos += len(buf)
+
+    def probe_tracks(self, tracks: Optional[Iterable[track_t]] = None) -> List[track_probe_t]:
+        """ Read the HCA header of each of tracks (all of them by default)
+            without reading any audio: channels, sample rate, block count and
+            size, loop points, cipher type and duration (see
+            acb.hca.hca_info_t). Returns a track_probe_t per track, in the same
+            order. hca is None for tracks that aren't HCAs, or whose header
+            can't be read.
+
+            Only the first few hundred bytes of each track are read, so this
+            is cheap even for very large AWBs. No keys are needed.
+        """
+        tracks = list(self.track_list.tracks if tracks is None else tracks)
+        located = [(i, self._find_entry(track)) for i, track in enumerate(tracks)]
+        # Visit the archives front to back.
+        located.sort(key=lambda x: (tracks[x[0]].is_stream, x[1][1].offset))
+
+        results: List[Optional[_hca.hca_info_t]] = [None] * len(tracks)
+        for i, (archive, entry) in located:
+            with _phase(self.stats, "read") as p:
+                head = archive.file_data_range(entry, 0, _hca.PROBE_SIZE, rw=True)
+                if _hca.is_hca(head) and _hca.header_size(head) > len(head):
+                    head += archive.file_data_range(entry, len(head), _hca.header_size(head) - len(head), rw=True)
+                p.add(len(head))
+            if not _hca.is_hca(head):
+                continue
+            try:
+                results[i] = _hca.parse_header(head)
+            except (ValueError, struct.error):
+                pass
+
+        return [track_probe_t(track, info) for track, info in zip(tracks, results)]
+
+    def _locate(self, track: track_t, disarm: Optional[bool]) -> Tuple[AFSArchive, afs2_file_ent_t, Optional[DisarmContext], bool]:
+        """ Find where a track lives. Returns (archive, entry, disarmer, mapped);
+            disarmer is None unless the track should be decrypted. """
+        archive, entry = self._find_entry(track)
+        if track.is_stream:
             disarmer = self.get_external_disarm()
+            mapped = self.awb_map is not None
         else:
-            if not self.embedded_awb:
-                raise ValueError("Track {0} is internal, but this ACB file has no internal AWB.".format(track))
-
-            buf = self.embedded_awb.file_data_for_cue_id(track.memory_wav_id, rw=True)
             disarmer = self.get_embedded_disarm()
+            mapped = self.acb_map is not None
 
         if disarm is True and not disarmer:
             raise ValueError(
@@ -301,13 +692,25 @@ class ACBFile(object):
                 "or provide keys using the hca_keys= argument to ACBFile."
             )
     
-        if disarm is None:
-            disarm = (disarmer is not None)
+        if disarm is False:
+            disarmer = None
 
-        if disarm and disarmer:
-            disarmer.disarm(buf, not unmask)
+        return archive, entry, disarmer, mapped
 
-        return buf
+    def _find_entry(self, track: track_t) -> Tuple[AFSArchive, afs2_file_ent_t]:
+        """ The archive a track is in and its entry, without setting up
+            anything needed to decrypt it. """
+        if self.closed:
+            raise ValueError("ACBFile is closed")
+
+        if track.is_stream:
+            if not self.external_awb:
+                raise ValueError("Track {0} is streamed, but there's no external AWB attached.".format(track))
+            return self.external_awb, self.external_awb.entry_for_cue_id(track.external_wav_id)
+        else:
+            if not self.embedded_awb:
+                raise ValueError("Track {0} is internal, but this ACB file has no internal AWB.".format(track))
+            return self.embedded_awb, self.embedded_awb.entry_for_cue_id(track.memory_wav_id)
 
     def __enter__(self):
         return self
@@ -328,6 +731,15 @@ class ACBFile(object):
         if self.awb_handle_owned and self.awb_handle:
             self.awb_handle.close()
             self.awb_handle_owned = False
+        # The archives may hold views into the mappings, let go of them first.
+        self._embedded_awb = None
+        self._external_awb = None
+        self.acb_src = None
+        if self.acb_map is not None or self.awb_map is not None:
+            _unmap(self.acb_map)
+            _unmap(self.awb_map)
+            self.acb_map = None
+            self.awb_map = None
         self.closed = True
 
     def __del__(self):
@@ -343,6 +755,45 @@ def find_awb(path):
 def name_gen_default(track):
     return "{0}{1}".format(track.name, wave_type_ftable.get(track.enc_type, track.enc_type))
 
+def _extract_track_incremental(acb: ACBFile, track: track_t, path: str, no_unmask: bool,
+        previous: Optional[Dict[str, Any]], source_unchanged: bool) -> Dict[str, Any]:
+    archive, entry, disarmer, mapped = acb._locate(track, None)
+    record = {
+        "archive": "stream" if track.is_stream else "memory",
+        "offset": entry.offset,
+        "size": entry.size,
+    }
+
+    # Same source files and same place in the archive: the output we wrote
+    # last time is still good, so don't even read the data.
+    if (source_unchanged and previous and previous.get("offset") == entry.offset
+            and previous.get("size") == entry.size and _manifest.output_matches(path, previous)):
+        return previous
+
+    start = time.perf_counter()
+    with _phase(acb.stats, "read", entry.size):
+        buf = archive.file_data_for_entry(entry, rw=disarmer is not None)
+    record["source_sha1"] = _manifest.content_hash(buf)
+    if (previous and previous.get("source_sha1") == record["source_sha1"]
+            and _manifest.output_matches(path, previous)):
+        previous.update(record)
+        return previous
+
+    if disarmer:
+        with _phase(acb.stats, "disarm", entry.size):
+            disarmer.disarm(buf, no_unmask)
+
+    with _phase(acb.stats, "write", len(buf)):
+        with open(path, "wb") as out_file:
+            out_file.write(buf)
+    acb._track_done(track, start, entry.size, disarmer)
+
+    st = os.stat(path)
+    record["output_sha1"] = _manifest.content_hash(buf)
+    record["output_size"] = st.st_size
+    record["output_mtime_ns"] = st.st_mtime_ns
+    return record
+
 def extract_acb(
     acb_file: AnyFile,
     target_dir: str,
@@ -350,7 +801,11 @@ def extract_acb(
     hca_keys: Optional[str] = None,
     name_gen: Callable[[track_t], str] = name_gen_default,
     no_unmask: bool = False,
-    encoding: Optional[str] = None
+    encoding: Optional[str] = None,
+    workers: Optional[int] = None,
+    incremental: bool = False,
+    stats: Optional[Stats] = None,
+    keyring: Optional[Union[str, Keyring]] = None
 ):
     """ Oneshot file extraction API. Dumps all tracks from a file into the
         named output directory.
@@ -368,13 +823,74 @@ def extract_acb(
             i.e. True will result in unmasking being disabled.
         - encoding: Encoding used for track names. See ACBFile's docstring
             for behaviour when this argument is None/omitted. 
+        - workers: Number of threads to read, decrypt and write tracks with.
+            None or 1 extracts tracks one at a time. The output is the same
+            either way; name_gen is always called in track order from the
+            calling thread.
+        - incremental: Keep a manifest (see acb.manifest) in target_dir and
+            only write tracks that changed since the last extraction. If the
+            ACB and AWB files are unchanged, no track data is read at all;
+            otherwise, tracks whose raw data hashes the same as last time are
+            skipped. acb_file (and extern_awb, if given) must be paths.
+        - stats: A Stats object (see acb.stats) to record timings in. Its
+            clock is stopped when extraction finishes, and it's returned.
+        - keyring: Same as ACBFile's keyring argument.
     """
     if isinstance(acb_file, str) and extern_awb is None:
         extern_awb = find_awb(acb_file)
-
-    with ACBFile(acb_file, extern_awb=extern_awb, hca_keys=hca_keys, encoding=encoding) as acb:
+    if isinstance(keyring, (str, os.PathLike)):
+        keyring = load_keyring(keyring)
+
+    manifest = None
+    if incremental:
+        if not isinstance(acb_file, (str, os.PathLike)) or not isinstance(extern_awb, (str, os.PathLike, type(None))):
+            raise ValueError("incremental extraction needs acb_file and extern_awb to be paths")
+
+        manifest = _manifest.Manifest(target_dir)
+        previous = manifest.source(acb_file)
+        source = {
+            "acb": _manifest.file_identity(acb_file),
+            "awb": _manifest.file_identity(extern_awb),
+            "options": _manifest.options_hash(hca_keys, no_unmask, encoding)
+                if keyring is None else _manifest.options_hash(hca_keys, no_unmask, encoding, sorted(keyring.keys)),
+        }
+        source_unchanged = all(previous.get(k) == v for k, v in source.items())
+        if previous.get("options") != source["options"]:
+            previous = {}
+        previous_tracks = previous.get("tracks", {})
+
+    with ACBFile(acb_file, extern_awb=extern_awb, hca_keys=hca_keys, encoding=encoding, stats=stats,
+            keyring=keyring) as acb:
+        # If several tracks map to the same name, the last one wins, as it
+        # would if they were written one after another.
+        targets: Dict[str, track_t] = {}
         for track in acb.track_list.tracks:
             name = name_gen(track)
+            targets.pop(name, None)
+            targets[name] = track
+
+        def write_track(item):
+            name, track = item
+            path = os.path.join(target_dir, name)
+            if manifest is not None:
+                return _extract_track_incremental(acb, track, path, no_unmask,
+                    previous_tracks.get(name), source_unchanged)
 
-            with open(os.path.join(target_dir, name), "wb") as out_file:
-                out_file.write(acb.get_track_data(track, unmask=not no_unmask))
+            with open(path, "wb") as out_file:
+                acb.write_track(track, out_file, unmask=not no_unmask)
+
+        if workers is None or workers <= 1:
+            results = [write_track(item) for item in targets.items()]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # Collecting the results also raises the first error here.
+                results = list(pool.map(write_track, targets.items()))
+
+    if manifest is not None:
+        source["tracks"] = dict(zip(targets, results))
+        manifest.set_source(acb_file, source)
+        manifest.save()
+
+    if stats is not None:
+        stats.finish()
+    return stats
@@ -0,0 +1,109 @@
+# aio.py: asyncio wrapper around ACBFile
+
+import asyncio
+import collections
+import functools
+from concurrent.futures import Executor
+from typing import AsyncIterator, Iterable, Optional, Tuple, Union
+
+from .acb import ACBFile, TrackList, track_t
+
+class AsyncACBFile(object):
+    """ asyncio facade for ACBFile. Parsing, reads and decryption all run on
+        an executor, so the event loop isn't blocked by file I/O or by
+        disarming HCAs.
+
+        Use AsyncACBFile.open() to create one:
+
+            async with await AsyncACBFile.open("file.acb", hca_keys=...) as acb:
+                async for track, data in acb.iter_tracks():
+                    ...
+
+        - executor: concurrent.futures executor to run work on. None uses the
+            event loop's default executor.
+        - concurrency: Maximum number of operations this object will have
+            running on the executor at once.
+    """
+    def __init__(self, acb: ACBFile, executor: Optional[Executor] = None, concurrency: int = 4):
+        self.acb = acb
+        self.executor = executor
+        self.concurrency = concurrency
+        # Made in the loop that first uses it; see _run.
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.semaphore_loop = None
+
+    @classmethod
+    async def open(cls, *args, executor: Optional[Executor] = None, concurrency: int = 4, **kwargs) -> "AsyncACBFile":
+        """ Open an ACB file. Takes the same arguments as ACBFile, plus
+            executor and concurrency (see the class docstring). """
+        loop = asyncio.get_running_loop()
+        acb = await loop.run_in_executor(executor, functools.partial(ACBFile, *args, **kwargs))
+        return cls(acb, executor, concurrency)
+
+    @property
+    def track_list(self) -> TrackList:
+        return self.acb.track_list
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.semaphore_loop is not loop:
+            # Before Python 3.10, a semaphore sticks to the loop that was
+            # current when it was made, so it can't be made in __init__.
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            self.semaphore_loop = loop
+        async with self.semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def get_track_data(self, track: track_t, disarm: Optional[bool] = None, unmask: bool = True) -> Union[bytearray, memoryview]:
+        """ See ACBFile.get_track_data. """
+        return await self._run(self.acb.get_track_data, track, disarm, unmask)
+
+    async def iter_tracks(self, tracks: Optional[Iterable[track_t]] = None, disarm: Optional[bool] = None,
+            unmask: bool = True) -> AsyncIterator[Tuple[track_t, Union[bytearray, memoryview]]]:
+        """ Yields (track, data) for each of tracks (default: all of them), in
+            order. Up to concurrency tracks are read ahead in the background.
+        """
+        if tracks is None:
+            tracks = self.acb.track_list.tracks
+
+        remaining = iter(tracks)
+        pending = collections.deque() # type: ignore
+
+        def fill():
+            while len(pending) < self.concurrency:
+                track = next(remaining, None)
+                if track is None:
+                    return
+                pending.append((track, asyncio.ensure_future(self.get_track_data(track, disarm, unmask))))
+
+        try:
+            fill()
+            while pending:
+                track, future = pending.popleft()
+                data = await future
+                fill()
+                yield track, data
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    async def stream_track_data(self, track: track_t, disarm: Optional[bool] = None, unmask: bool = True,
+            **kwargs) -> AsyncIterator[Union[bytearray, memoryview]]:
+        """ See ACBFile.stream_track_data. Each piece is read (and decrypted)
+            on the executor. """
+        chunks = await self._run(self.acb.stream_track_data, track, disarm, unmask, **kwargs)
+        done = object()
+        while 1:
+            chunk = await self._run(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+    async def close(self):
+        await self._run(self.acb.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
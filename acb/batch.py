@@ -0,0 +1,172 @@
+# batch.py: extract whole directory trees of ACBs in one go
+
+import argparse
+import functools
+import glob
+import os
+import sys
+import time
+from collections import namedtuple as T
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .acb import extract_acb, find_awb, name_gen_default
+from .keyring import Keyring, load_keyring
+
+batch_result_t = T("batch_result_t", ("acb_path", "target_dir", "tracks", "bytes_in", "error"))
+
+def iter_acb_files(inputs: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """ Expand inputs into (acb_path, root) pairs. Each input can be an ACB
+        file, a directory (searched recursively for .acb files), a glob
+        pattern, or "-" to read more inputs from stdin, one per line. root is
+        what the ACB's output location is made relative to.
+    """
+    seen = set()
+
+    def expand(item):
+        if item == "-":
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    yield from expand(line)
+        elif os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith(".acb"):
+                        yield os.path.join(dirpath, name), item
+        elif os.path.exists(item):
+            yield item, os.path.dirname(item)
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                if os.path.isdir(path):
+                    yield from expand(path)
+                elif path.endswith(".acb"):
+                    yield path, os.path.dirname(path)
+
+    for item in inputs:
+        for path, root in expand(item):
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                yield path, root
+
+def target_dir_for(acb_path: str, root: str, output_dir: Optional[str]) -> str:
+    """ Where the tracks of acb_path go: a directory named after the ACB,
+        mirroring its location under root inside output_dir (or next to the
+        ACB, if there's no output_dir). """
+    stem = os.path.splitext(os.path.basename(acb_path))[0]
+    if output_dir is None:
+        return os.path.join(os.path.dirname(acb_path), stem)
+
+    rel = os.path.relpath(os.path.dirname(os.path.abspath(acb_path)), os.path.abspath(root or "."))
+    return os.path.normpath(os.path.join(output_dir, rel, stem))
+
+@functools.lru_cache(maxsize=None)
+def _worker_keyring(path: str) -> Keyring:
+    # One per worker process, so keys that matched float to the front for
+    # the next file.
+    return load_keyring(path)
+
+def _extract_one(acb_path: str, target_dir: str, options: dict) -> batch_result_t:
+    # Runs in a worker process, so errors are returned instead of raised.
+    bytes_in = 0
+    tracks = []
+    def name_gen(track):
+        tracks.append(track)
+        return options["name_gen"](track)
+
+    try:
+        # The file may have gone away (or be a dangling link) since the walk.
+        awb_path = find_awb(acb_path)
+        bytes_in = os.path.getsize(acb_path)
+        if awb_path:
+            bytes_in += os.path.getsize(awb_path)
+
+        os.makedirs(target_dir, 0o755, exist_ok=True)
+        extract_acb(acb_path, target_dir, awb_path, hca_keys=options["hca_keys"], name_gen=name_gen,
+            no_unmask=options["no_unmask"], encoding=options["encoding"], incremental=options["incremental"],
+            keyring=options["keyring"] and _worker_keyring(options["keyring"]))
+    except Exception as e:
+        return batch_result_t(acb_path, target_dir, len(tracks), bytes_in, "{0}: {1}".format(type(e).__name__, e))
+
+    return batch_result_t(acb_path, target_dir, len(tracks), bytes_in, None)
+
+def extract_tree(
+    inputs: Iterable[str],
+    output_dir: Optional[str] = None,
+    hca_keys: Optional[str] = None,
+    no_unmask: bool = False,
+    encoding: Optional[str] = None,
+    jobs: Optional[int] = None,
+    name_gen: Optional[Callable] = None,
+    incremental: bool = False,
+    progress: Optional[Callable[[int, int, batch_result_t], None]] = None,
+    keyring: Optional[str] = None
+) -> List[batch_result_t]:
+    """ Extract every ACB found in inputs (see iter_acb_files), spreading
+        files across a pool of jobs processes (default: one per CPU). Each
+        ACB is paired with its AWB using find_awb.
+
+        A file that fails to extract doesn't stop the others; its result
+        has the error message set. progress, if given, is called from this
+        process as progress(done, total, result) after each file finishes.
+        name_gen must be picklable (a top level function). See extract_acb
+        for incremental and keyring (which must be a path here; each worker
+        process loads it).
+    """
+    options = dict(hca_keys=hca_keys, no_unmask=no_unmask, encoding=encoding,
+        name_gen=name_gen or name_gen_default, incremental=incremental, keyring=keyring)
+    work = [(path, target_dir_for(path, root, output_dir)) for path, root in iter_acb_files(inputs)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_extract_one, path, target, options) for path, target in work]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if progress:
+                progress(len(results), len(futures), result)
+
+    return results
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="acbextract batch",
+        description="Extract many ACB files at once. Tracks from each ACB go in a directory named after it.")
+    keys = parser.add_mutually_exclusive_group()
+    keys.add_argument("--disarm-with", help="decrypt HCAs with provided keys")
+    keys.add_argument("--keyring", metavar="PATH",
+        help="decrypt HCAs with whichever key fits from a file of keys, one per line")
+    parser.add_argument("--no-unmask", action="store_true", default=False,
+        help="don't unmask segment names (requires --disarm-with or --keyring)")
+    parser.add_argument("--encoding", default=None, help="files' encoding")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of files to extract in parallel (default: one per CPU)")
+    parser.add_argument("-o", "--output-dir", default=None,
+        help="directory to mirror the input tree into (default next to each input file)")
+    parser.add_argument("--incremental", action="store_true", default=False,
+        help="skip files and tracks that haven't changed since the last extraction")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False, help="only print errors and the summary")
+    parser.add_argument("inputs", nargs="+",
+        help="ACB files, directories, glob patterns, or - to read paths from stdin")
+
+    args = parser.parse_args(argv)
+
+    def progress(done, total, result):
+        if result.error:
+            print("[{0}/{1}] error: {2}: {3}".format(done, total, result.acb_path, result.error), file=sys.stderr)
+        elif not args.quiet:
+            print("[{0}/{1}] {2} ({3} tracks)".format(done, total, result.acb_path, result.tracks), file=sys.stderr)
+
+    start = time.perf_counter()
+    results = extract_tree(args.inputs, args.output_dir, args.disarm_with, args.no_unmask, args.encoding,
+        jobs=args.jobs, incremental=args.incremental, progress=progress, keyring=args.keyring)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    failed = [r for r in results if r.error]
+    total_bytes = sum(r.bytes_in for r in results)
+    print("{0} files, {1} tracks, {2:.1f} MB in {3:.2f}s ({4:.1f} files/s, {5:.1f} MB/s), {6} failed".format(
+        len(results), sum(r.tracks for r in results), total_bytes / 1e6, elapsed,
+        len(results) / elapsed, total_bytes / 1e6 / elapsed, len(failed)), file=sys.stderr)
+
+    return 1 if failed else 0
@@ -1,11 +1,22 @@
+import functools
 import struct
-from typing import Optional
+from collections import namedtuple as T
+from typing import List, Optional
 
 try:
     import _acb_speedup
 except ImportError:
     _acb_speedup = None
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Which implementation disarm_blocks uses; see set_disarm_backend.
+DISARM_BACKENDS = ("auto", "c", "numpy", "python")
+_backend = "auto"
+
 SECTION_SIZES = {
     b"HCA\x00": 8,
     b"fmt\x00": 16,
@@ -55,16 +66,45 @@ CHECKSUM_TABLE = (
     0x8213, 0x0216, 0x021C, 0x8219, 0x0208, 0x820D, 0x8207, 0x0202
 )
 
+# Where the blocks are in an HCA file, as found by DisarmContext.disarm_header.
+hca_layout_t = T("hca_layout_t", ("header_size", "block_count", "block_size", "ciph_type"))
+
+# CHECKSUM_TABLE extended to 16 bits, so the pure Python checksum can eat
+# two bytes per step. Built on first use since it's only needed without
+# _acb_speedup. The NumPy backend keeps its own copy as an array.
+CHECKSUM_TABLE_16: Optional[List[int]] = None
+CHECKSUM_TABLE_16_NP = None
+
+def _init_checksum_table_16() -> List[int]:
+    table = []
+    for hi in range(256):
+        s = CHECKSUM_TABLE[hi]
+        for lo in range(256):
+            table.append(((s << 8) ^ CHECKSUM_TABLE[(s >> 8) ^ lo]) & 0xffff)
+    return table
+
+def _checksum_table_16() -> List[int]:
+    global CHECKSUM_TABLE_16
+    if CHECKSUM_TABLE_16 is None:
+        CHECKSUM_TABLE_16 = _init_checksum_table_16()
+    return CHECKSUM_TABLE_16
+
 def checksum(buf: bytes):
     """
     Calculate the checksum of a block.
     """
     if _acb_speedup:
         return _acb_speedup.checksum_fast(buf)
+    return _checksum_py(buf)
 
+def _checksum_py(buf: bytes):
+    table = _checksum_table_16()
+    size = len(buf)
     sum = 0
-    for byte in buf:
-        sum = ((sum << 8) ^ CHECKSUM_TABLE[(sum >> 8) ^ byte]) & 0xffff
+    for word in struct.unpack_from(">{0}H".format(size // 2), buf):
+        sum = table[sum ^ word]
+    if size & 1:
+        sum = ((sum << 8) ^ CHECKSUM_TABLE[(sum >> 8) ^ buf[size - 1]]) & 0xffff
     return sum
 
 def _sub1_rollover(i: int) -> int:
@@ -87,6 +127,146 @@ def _mix_header_key(kl, hk):
     k2p = (hk << 16) | (((hk ^ 0xffff) + 2) & 0xffff)
     return (kl * k2p) & 0xffffffffffffffff
 
+def _derive_key_table_py(keya: int, keyb: int) -> bytearray:
+    if keya == 0:
+        keyb = _sub1_rollover(keyb)
+    keya = _sub1_rollover(keya)
+
+    stage1 = bytearray(8)
+    for i in range(7):
+        stage1[i] = keya & 0xff
+        keya = ((keya >> 8) | (keyb << 24)) & 0xffffffff
+        keyb >>= 8
+
+    s2_ri = (1, 2, 3, 4, 5, 6, 1)
+    s2_li = (0, 6, 1, 2, 3, 4, 5)
+    stage2 = bytearray(16)
+
+    for i in range(0, 16, 3):
+        stage2[i] = stage1[i // 3 + 1]
+
+    for i in range(1, 16, 3):
+        j = i // 3 + 1
+        stage2[i] = stage1[j] ^ stage1[s2_li[j]]
+
+    for i in range(2, 16, 3):
+        j = i // 3 + 2
+        stage2[i] = stage1[j] ^ stage1[s2_ri[j]]
+
+    stage3 = bytearray(256)
+    high = _small_rng(stage1[0])
+    for i in range(16):
+        base = 16 * i
+        low = _small_rng(stage2[i])
+        hi = high[i] << 4
+        for j in range(16):
+            stage3[base + j] = hi | low[j]
+
+    key_table_2 = bytearray(256)
+    key_table_2[0x00] = 0
+    key_table_2[0xff] = 0xff
+    srci = 0x11
+    for i in range(1, 255):
+        while stage3[srci] in (0x0, 0xff):
+            srci = (srci + 0x11) & 0xff
+
+        key_table_2[i] = stage3[srci]
+        srci = (srci + 0x11) & 0xff
+
+    return key_table_2
+
+@functools.lru_cache(maxsize=1024)
+def derive_key_table(keya: int, keyb: int) -> bytes:
+    """
+    Build the cipher type 56 substitution table for a (mixed) key. Results
+    are cached process-wide, so opening many files that share keys only pays
+    for this once; see derive_key_table.cache_info().
+    """
+    if _acb_speedup and hasattr(_acb_speedup, "derive_key_table_fast"):
+        return _acb_speedup.derive_key_table_fast(keya, keyb)
+    return bytes(_derive_key_table_py(keya, keyb))
+
+def unmask_header(buf: bytearray, header_size: int):
+    """ Remove masking of section names from an HCA header. Masking doesn't
+        depend on the keys, so this is usable without a DisarmContext. """
+    base = 0
+    while base < header_size:
+        tag = bytes(x & 0x7f for x in buf[base:base + 4])
+        buf[base:base + 4] = tag
+
+        if tag == b"pad\x00":
+            break
+        if tag == b"comm":
+            base += buf[base + 4]
+
+        base += SECTION_SIZES.get(tag, 4)
+
+def disarm_backend() -> str:
+    """ Which implementation DisarmContext will use to decrypt blocks: "c"
+        (the _acb_speedup extension), "numpy", or "python". Unless another
+        was picked with set_disarm_backend, that's the first of those that's
+        installed. """
+    if _backend == "python" or (_backend == "c" and not _acb_speedup):
+        return "python"
+    if _backend == "numpy" or (not _acb_speedup and numpy is not None):
+        return "numpy"
+    return "c" if _acb_speedup else "python"
+
+def set_disarm_backend(name: str):
+    """ Pick the implementation used to decrypt blocks: one of
+        DISARM_BACKENDS. "auto" (the default) goes back to choosing the
+        fastest one available. ValueError is raised if the backend isn't
+        known or isn't installed. All backends give the same
+        results, for truncated blocks too. """
+    global _backend
+    if name not in DISARM_BACKENDS:
+        raise ValueError("unknown disarm backend {0!r}".format(name))
+    if name == "c" and not _acb_speedup:
+        raise ValueError("the c disarm backend needs the _acb_speedup extension")
+    if name == "numpy" and numpy is None:
+        raise ValueError("the numpy disarm backend needs NumPy")
+    _backend = name
+
+# Blocks checksummed per pass by the NumPy backend: enough to make each
+# step worth a call, few enough to stay in cache.
+NUMPY_CHUNK_BLOCKS = 1024
+
+def _disarm_blocks_numpy(buf: bytearray, base: int, blockcnt: int, blocksize: int, usetable: bytes):
+    global CHECKSUM_TABLE_16_NP
+    if CHECKSUM_TABLE_16_NP is None:
+        CHECKSUM_TABLE_16_NP = numpy.array(_checksum_table_16(), dtype=numpy.uint16)
+    table = CHECKSUM_TABLE_16_NP
+
+    # Substitute everything in one go. bytes.translate beats a NumPy take
+    # here, since take converts the indices to intp first.
+    stop = base + blockcnt * blocksize
+    view = memoryview(buf)
+    view[base:stop] = bytes(view[base:stop]).translate(usetable)
+
+    # Then checksum the blocks side by side: treat them as the rows of a
+    # matrix and feed the CRCs a column (two bytes of every block) per step.
+    size = blocksize - 2
+    table_8 = numpy.array(CHECKSUM_TABLE, numpy.uint16) if size & 1 else None
+    for first in range(0, blockcnt, NUMPY_CHUNK_BLOCKS):
+        count = min(NUMPY_CHUNK_BLOCKS, blockcnt - first)
+        blocks = numpy.frombuffer(buf, numpy.uint8, count * blocksize, base + first * blocksize)
+        blocks = blocks.reshape(count, blocksize)
+        columns = blocks[:, :size].T
+        words = (columns[0:size - 1:2].astype(numpy.uint16) << 8) | columns[1:size:2]
+
+        crc = numpy.zeros(count, numpy.uint16)
+        index = numpy.empty(count, numpy.uint16)
+        for word in words:
+            numpy.bitwise_xor(crc, word, out=index)
+            table.take(index, out=crc)
+        if size & 1:
+            # uint16 arithmetic drops the bits shifted out the top.
+            last = table_8.take((crc >> 8) ^ columns[size - 1])
+            crc = (crc << 8) ^ last
+
+        blocks[:, size] = crc >> 8
+        blocks[:, size + 1] = crc & 0xFF
+
 class DisarmContext(object):
     KEY_TABLE_1: bytearray = None # type: ignore
 
@@ -133,56 +313,8 @@ class DisarmContext(object):
 
         self.key_table_2 = self._init_table2()
 
-    def _init_table2(self) -> bytearray:
-        keya = self.keya
-        keyb = self.keyb
-
-        if keya == 0:
-            keyb = _sub1_rollover(keyb)
-        keya = _sub1_rollover(keya)
-
-        stage1 = bytearray(8)
-        for i in range(7):
-            stage1[i] = keya & 0xff
-            keya = ((keya >> 8) | (keyb << 24)) & 0xffffffff
-            keyb >>= 8
-
-        s2_ri = (1, 2, 3, 4, 5, 6, 1)
-        s2_li = (0, 6, 1, 2, 3, 4, 5)
-        stage2 = bytearray(16)
-
-        for i in range(0, 16, 3):
-            stage2[i] = stage1[i // 3 + 1]
-
-        for i in range(1, 16, 3):
-            j = i // 3 + 1
-            stage2[i] = stage1[j] ^ stage1[s2_li[j]]
-
-        for i in range(2, 16, 3):
-            j = i // 3 + 2
-            stage2[i] = stage1[j] ^ stage1[s2_ri[j]]
-
-        stage3 = bytearray(256)
-        high = _small_rng(stage1[0])
-        for i in range(16):
-            base = 16 * i
-            low = _small_rng(stage2[i])
-            hi = high[i] << 4
-            for j in range(16):
-                stage3[base + j] = hi | low[j]
-
-        key_table_2 = bytearray(256)
-        key_table_2[0x00] = 0
-        key_table_2[0xff] = 0xff
-        srci = 0x11
-        for i in range(1, 255):
-            while stage3[srci] in (0x0, 0xff):
-                srci = (srci + 0x11) & 0xff
-
-            key_table_2[i] = stage3[srci]
-            srci = (srci + 0x11) & 0xff
-
-        return key_table_2
+    def _init_table2(self) -> bytes:
+        return derive_key_table(self.keya, self.keyb)
 
     def disarm(self, buf: bytearray, no_unmask: bool=False):
         """
@@ -190,6 +322,17 @@ class DisarmContext(object):
         - no_unmask: If true, this will leave section names alone, which means
           files will not be decodable by ffmpeg.
         """
+        layout = self.disarm_header(buf, no_unmask)
+        if layout:
+            self.disarm_blocks(buf, *layout)
+
+    def disarm_header(self, buf: bytearray, no_unmask: bool=False) -> Optional[hca_layout_t]:
+        """
+        Unmask the HCA header at the start of buf and mark it as unencrypted.
+        buf only needs to hold the header (the size is at buf[6:8]).
+        Returns the layout of the blocks to pass to disarm_blocks, or None
+        if the blocks aren't encrypted.
+        """
         magic = buf[:4]
         masked = True if magic[0] & 0x80 else False
         header_size = struct.unpack(">H", buf[6:8])[0]
@@ -209,7 +352,7 @@ class DisarmContext(object):
         try:
             ciph_seg = buf.index(b"\xe3\xe9\xf0\xe8" if masked else b"ciph", 0, header_size)
         except ValueError:
-            return
+            return None
 
         try:
             fmt_seg = buf.index(b"\xe6\xed\xf4\x00" if masked else b"fmt\x00", 0, header_size)
@@ -221,9 +364,10 @@ class DisarmContext(object):
         ciph_type = struct.unpack(">H", buf[ciph_seg + 4:ciph_seg + 6])[0]
 
         if ciph_type == 0:
-            return
+            return None
 
-        self.disarm_blocks(buf, header_size, block_cnt, block_size, ciph_type)
+        # Raises for unknown cipher types before we touch anything else.
+        self.table_for_ciph_type(ciph_type)
         buf[ciph_seg + 4:ciph_seg + 6] = b"\x00\x00"
 
         end = header_size - 2
@@ -232,27 +376,20 @@ class DisarmContext(object):
         else:
             buf[end:end + 2] = checksum(memoryview(buf)[:end]).to_bytes(2, "big")
 
+        return hca_layout_t(header_size, block_cnt, block_size, ciph_type)
+
     def unmask_header(self, buf: bytearray, header_size: int):
         """
         Remove masking of section names from the HCA header.
         This does not update the checksum or modify any section content.
         """
-        base = 0
-        while base < header_size:
-            tag = bytes(x & 0x7f for x in buf[base:base + 4])
-            buf[base:base + 4] = tag
-
-            if tag == b"pad\x00":
-                break
-            if tag == b"comm":
-                base += buf[base + 4]
-
-            base += SECTION_SIZES.get(tag, 4)
+        unmask_header(buf, header_size)
 
     def disarm_blocks(self, buf: bytearray, from_pos: int, block_count: int, block_size: int, ciph_type: int):
         """
         Remove encryption from one or more HCA blocks. buf should be at least 
-        from_pos + (block_size * block_count) bytes long.
+        from_pos + (block_size * block_count) bytes long; if it's shorter, only
+        what's there is decrypted, the last partial block as a short block.
 
         - from_pos: Start of the first block as an offset into buf.
         - block_count: Number of blocks to decrypt.
@@ -261,30 +398,60 @@ class DisarmContext(object):
         """
         if ciph_type == 0:
             return
-        elif ciph_type == 1:
-            usetable = self.KEY_TABLE_1
+
+        self.disarm_actual(buf, from_pos, block_count, block_size, self.table_for_ciph_type(ciph_type))
+
+    def table_for_ciph_type(self, ciph_type: int) -> bytes:
+        if ciph_type == 1:
+            return self.KEY_TABLE_1
         elif ciph_type == 56:
-            usetable = self.key_table_2
+            return self.key_table_2
         else:
             raise ValueError("unknown cipher type")
-        
-        self.disarm_actual(buf, from_pos, block_count, block_size, usetable)
 
     def disarm_actual(self, buf: bytearray, frompos: int, blockcnt: int, blocksize: int, usetable: bytearray):
         """
         Do not call this method. If you were already using this, update your code to 
         use disarm_blocks().
         """
+        if blockcnt <= 0:
+            return
+        if blocksize < 2:
+            raise ValueError("invalid block size")
+
+        # Truncated files have fewer blocks than the header says. Decrypt
+        # the ones that are there, and the partial one at the end as if it
+        # were a (short) block of its own.
         base = frompos
-        stop = frompos + (blocksize * blockcnt)
+        stop = min(frompos + (blocksize * blockcnt), len(buf))
+        blockcnt = max(0, stop - base) // blocksize
+        tail = stop - base - blockcnt * blocksize
+        stop = base + blockcnt * blocksize
+        if tail >= 2:
+            self.disarm_actual(buf, stop, 1, tail, usetable)
+
+        backend = disarm_backend()
+        if backend == "c" and hasattr(_acb_speedup, "disarm_blocks_fast"):
+            # One call for the whole run of blocks, with the GIL released.
+            _acb_speedup.disarm_blocks_fast(memoryview(buf)[base:stop], usetable, blocksize)
+            return
+
+        if backend == "numpy":
+            if blockcnt > 0:
+                _disarm_blocks_numpy(buf, base, blockcnt, blocksize, usetable)
+            return
+
+        if backend != "c":
+            # Substitute everything in one go. This also garbles the checksums,
+            # but we overwrite those below anyway.
+            view = memoryview(buf)
+            view[base:stop] = bytes(view[base:stop]).translate(usetable)
+
         while base < stop:
-            if _acb_speedup:
+            if backend == "c":
                 _acb_speedup.disarm_block_fast(memoryview(buf)[base:base + blocksize], usetable)
             else:
-                for i in range(base, base + blocksize - 2):
-                    buf[i] = usetable[buf[i]]
-
                 end = base + blocksize - 2
-                buf[end:end + 2] = checksum(memoryview(buf)[base:end]).to_bytes(2, "big")
+                buf[end:end + 2] = _checksum_py(memoryview(buf)[base:end]).to_bytes(2, "big")
 
             base += blocksize
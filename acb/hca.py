@@ -0,0 +1,133 @@
+# hca.py: reading HCA headers, for what's in a track without decoding it
+
+import struct
+from collections import namedtuple as T
+
+from .disarm import SECTION_SIZES, unmask_header
+
+# Enough for the header of nearly every HCA; probe reads this much up front
+# and only goes back for more if the header says it's bigger.
+PROBE_SIZE = 0x200
+
+# Samples per block, per channel.
+SAMPLES_PER_BLOCK = 1024
+
+hca_loop_t = T("hca_loop_t", ("start_block", "end_block", "start_delay", "end_padding"))
+# From the comp section, or the older dec section.
+hca_comp_t = T("hca_comp_t", ("min_resolution", "max_resolution", "track_count", "channel_config",
+    "total_band_count", "base_band_count", "stereo_band_count", "bands_per_hfr_group"))
+hca_info_t = T("hca_info_t", ("version", "header_size", "channels", "sample_rate", "block_count",
+    "encoder_delay", "encoder_padding", "block_size", "comp", "loop", "ciph_type", "samples", "duration"))
+
+def is_hca(buf) -> bool:
+    return len(buf) >= 8 and bytes(x & 0x7f for x in buf[:4]) == b"HCA\x00"
+
+def header_size(buf) -> int:
+    return struct.unpack_from(">H", buf, 6)[0]
+
+def parse_header(buf: bytearray) -> hca_info_t:
+    """ Read the fmt, comp/dec, loop and ciph sections of the HCA header at
+        the start of buf, which must hold the whole header (see header_size).
+        Masked section names are unmasked in place. Raises ValueError if buf
+        isn't an HCA header. """
+    if not is_hca(buf):
+        raise ValueError("not an HCA file")
+    version, size = struct.unpack_from(">HH", buf, 4)
+    if len(buf) < size:
+        raise ValueError("truncated HCA header")
+    unmask_header(buf, size)
+
+    fmt = None
+    block_size = None
+    comp = None
+    loop = None
+    ciph_type = 0
+    base = 0
+    while base < size:
+        tag = bytes(buf[base:base + 4])
+        if tag == b"fmt\x00":
+            channels, rate_hi, rate_lo, block_count, delay, padding = struct.unpack_from(">BBHIHH", buf, base + 4)
+            fmt = (channels, (rate_hi << 16) | rate_lo, block_count, delay, padding)
+        elif tag == b"comp":
+            block_size, *fields = struct.unpack_from(">H8B", buf, base + 4)
+            comp = hca_comp_t(*fields)
+        elif tag == b"dec\x00":
+            block_size, min_res, max_res, total, base_bands, layout, stereo_type = struct.unpack_from(">H6B", buf, base + 4)
+            total += 1
+            base_bands = base_bands + 1 if stereo_type else total
+            comp = hca_comp_t(min_res, max_res, layout >> 4, layout & 0xF, total, base_bands, total - base_bands, 0)
+        elif tag == b"loop":
+            loop = hca_loop_t(*struct.unpack_from(">IIHH", buf, base + 4))
+        elif tag == b"ciph":
+            ciph_type = struct.unpack_from(">H", buf, base + 4)[0]
+        elif tag == b"pad\x00":
+            break
+        if tag == b"comm":
+            base += buf[base + 4]
+        base += SECTION_SIZES.get(tag, 4)
+
+    if fmt is None:
+        raise ValueError("cannot find the fmt segment")
+    channels, sample_rate, block_count, delay, padding = fmt
+    samples = max(0, block_count * SAMPLES_PER_BLOCK - delay - padding)
+    return hca_info_t(version, size, channels, sample_rate, block_count, delay, padding, block_size, comp, loop,
+        ciph_type, samples, samples / sample_rate if sample_rate else 0.0)
+
+def scalefactor_count(info: hca_info_t) -> int:
+    """ How many scalefactors the first channel has in each block. """
+    comp = info.comp
+    count = comp.base_band_count + comp.stereo_band_count
+    if info.version > 0x0200 and comp.bands_per_hfr_group:
+        hfr_bands = comp.total_band_count - comp.base_band_count - comp.stereo_band_count
+        count += max(0, -(-hfr_bands // comp.bands_per_hfr_group))
+    return count
+
+def is_empty_block(block) -> bool:
+    """ Whether everything between the sync word and the checksum is zero
+        (silence). """
+    return block.count(0, 2, len(block) - 2) == len(block) - 4
+
+def check_block(block, scalefactors: int) -> bool:
+    """ Cheap sanity check of a decrypted block: that it starts with the sync
+        word, and that the first channel's scalefactors (see
+        scalefactor_count), the first thing in it, decode to values in range.
+        A block decrypted with the wrong key is as good as random bytes, and
+        random blocks fail this about 40% of the time with 128 scalefactors,
+        down to about 16% with 16 (measured over 20000 random blocks). """
+    if block[0] != 0xFF or block[1] != 0xFF:
+        return False
+
+    # Bits are read from the top; left is how many are still unread. Skip
+    # the noise level (9 bits) and evaluation boundary (7).
+    bits = int.from_bytes(block[2:len(block) - 2], "big")
+    left = (len(block) - 4) * 8 - 16 - 3
+    if left < 0:
+        return False
+    delta_bits = (bits >> left) & 7
+    if delta_bits == 0:
+        return True
+    if delta_bits >= 6:
+        # Every scalefactor is stored as is.
+        return left >= 6 * scalefactors
+
+    left -= 6
+    if left < 0:
+        return False
+    value = (bits >> left) & 0x3F
+    escape = (1 << delta_bits) - 1
+    bias = escape >> 1
+    for _ in range(scalefactors - 1):
+        left -= delta_bits
+        if left < 0:
+            return False
+        delta = (bits >> left) & escape
+        if delta == escape:
+            left -= 6
+            if left < 0:
+                return False
+            value = (bits >> left) & 0x3F
+        else:
+            value += delta - bias
+            if not 0 <= value < 64:
+                return False
+    return True
@@ -0,0 +1,145 @@
+# keyring.py: picking the right HCA key for an archive out of many
+
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from . import hca as _hca
+from .disarm import DisarmContext
+
+# How many archive entries to look at for encrypted HCAs, and how many
+# blocks to sample from them (at most BLOCKS_PER_TRACK from each).
+SCAN_ENTRIES = 16
+SAMPLE_BLOCKS = 64
+BLOCKS_PER_TRACK = 16
+
+class Keyring(object):
+    """ A list of HCA keys (in the same format as ACBFile's hca_keys), for
+        when you don't know which one a file needs. See detect_key.
+
+        Keys that matched recently are moved to the front of the list. Every
+        key is still tried for each file (see detect_key), but wrong ones are
+        usually given up on after a few blocks. """
+    def __init__(self, keys: Iterable[str]):
+        self.keys = list(keys)
+        self.lock = threading.Lock()
+
+    def detect(self, archive) -> Optional[str]:
+        """ detect_key(archive, self.keys). """
+        with self.lock:
+            keys = list(self.keys)
+        key = detect_key(archive, keys)
+        if key is not None:
+            with self.lock:
+                if key in self.keys:
+                    self.keys.remove(key)
+                self.keys.insert(0, key)
+        return key
+
+    def __len__(self):
+        return len(self.keys)
+
+def parse_key(keyspec: str) -> str:
+    """ Check that keyspec looks like an HCA key and return it. Raises
+        ValueError otherwise. """
+    for part in keyspec.split(","):
+        int(part, 16)
+    if keyspec.count(",") > 1:
+        raise ValueError("too many commas")
+    return keyspec
+
+def load_keyring(path: str) -> Keyring:
+    """ Read a keyring file: one key per line (e.g. 0x1234567890abcdef, or
+        0x90abcdef,0x12345678), with blank lines and anything after # ignored.
+    """
+    keys = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                keys.append(parse_key(line))
+            except ValueError:
+                raise ValueError("{0}:{1}: bad key {2!r}".format(path, lineno, line)) from None
+    return Keyring(keys)
+
+def sample_blocks(archive) -> List[Tuple[bytes, int]]:
+    """ Some encrypted blocks from the HCAs in archive that use key-dependent
+        encryption (cipher type 56), with the number of scalefactors to check
+        in each (see acb.hca.check_block). Silent blocks, which look the same
+        whatever the key, are left out. Empty if there's nothing to check. """
+    samples: List[Tuple[bytes, int]] = []
+    for entry in sorted(archive.files, key=lambda f: f.offset)[:SCAN_ENTRIES]:
+        head = archive.file_data_range(entry, 0, _hca.PROBE_SIZE, rw=True)
+        if not _hca.is_hca(head):
+            continue
+        if _hca.header_size(head) > len(head):
+            head += archive.file_data_range(entry, len(head), _hca.header_size(head) - len(head), rw=True)
+        try:
+            info = _hca.parse_header(head)
+        except ValueError:
+            continue
+        if info.ciph_type != 56 or not info.block_size or info.comp is None:
+            continue
+
+        count = min(BLOCKS_PER_TRACK, info.block_count, SAMPLE_BLOCKS - len(samples))
+        blocks = bytes(archive.file_data_range(entry, info.header_size, count * info.block_size))
+        scalefactors = _hca.scalefactor_count(info)
+        for pos in range(0, len(blocks) - info.block_size + 1, info.block_size):
+            block = blocks[pos:pos + info.block_size]
+            if not _hca.is_empty_block(block):
+                samples.append((block, scalefactors))
+
+        if len(samples) >= SAMPLE_BLOCKS:
+            break
+    return samples
+
+def detect_key(archive, keys: Iterable[str]) -> Optional[str]:
+    """ Find which of keys decrypts the HCAs in archive (an AFSArchive), by
+        decrypting a few blocks (see sample_blocks) with each one, mixed with
+        the archive's mix_key, and scoring how many pass
+        acb.hca.check_block. Only a few dozen KB of the archive are read.
+
+        The sync word at the start of each block can't be used for this: the
+        cipher maps 0xFF to itself whatever the key. The scalefactors that
+        follow it are what give a wrong key away, but only some of the time
+        per block (see acb.hca.check_block).
+
+        Every key is tried, since a wrong key can pass every sampled block
+        by chance, especially when there are only a few. The winner must fail
+        no more than 10% of the blocks and strictly fewer than any other key.
+        None is returned if there's no such key, or if there's nothing to
+        check (no HCAs, or only ones whose encryption doesn't depend on the
+        key).
+    """
+    keys = list(keys)
+    samples = sample_blocks(archive) if keys else []
+    if not samples:
+        return None
+
+    # The key with the fewest failures, and the two lowest failure counts.
+    # Keys over the limit are only counted up to it.
+    allowed = len(samples) // 10
+    best, best_failures, runner_up = None, allowed + 1, allowed + 1
+    for key in keys:
+        failures = _failures(archive, key, samples, runner_up)
+        if failures < best_failures:
+            best, best_failures, runner_up = key, failures, best_failures
+        elif failures < runner_up:
+            runner_up = failures
+        if runner_up == 0:
+            # Two keys pass everything; nothing can break the tie.
+            return None
+    return best if best_failures < runner_up else None
+
+def _failures(archive, key: str, samples: List[Tuple[bytes, int]], give_up: int) -> int:
+    """ How many of samples fail acb.hca.check_block with key, counting no
+        further than give_up. """
+    table = DisarmContext(key, archive.mix_key).key_table_2
+    failures = 0
+    for block, scalefactors in samples:
+        if not _hca.check_block(block.translate(table), scalefactors):
+            failures += 1
+            if failures >= give_up:
+                break
+    return failures
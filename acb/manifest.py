@@ -0,0 +1,73 @@
+# manifest.py: bookkeeping for incremental extraction
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+MANIFEST_NAME = ".acb_manifest.json"
+MANIFEST_VERSION = 1
+
+def file_identity(path: Optional[str]) -> Optional[Dict[str, int]]:
+    """ Cheap identity for a source file: its size and mtime. """
+    if path is None:
+        return None
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def content_hash(data) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+def options_hash(*options) -> str:
+    """ Fingerprint of the settings that change the output, so that e.g.
+        extracting with different keys isn't mistaken for a no-op. The
+        settings themselves (keys!) aren't stored. """
+    return content_hash(repr(options).encode("utf-8"))
+
+class Manifest(object):
+    """ Records what extract_acb wrote to a directory, per source ACB:
+
+        - acb/awb: identity (size, mtime) of the source files;
+        - options: options_hash of the extraction settings;
+        - tracks: for each output file name, where the track came from (AFS
+          archive, offset, size, hash of the raw data), plus the hash, size
+          and mtime of what was written.
+
+        The manifest lives in the target directory as .acb_manifest.json.
+    """
+    def __init__(self, target_dir: str):
+        self.path = os.path.join(target_dir, MANIFEST_NAME)
+        self.sources: Dict[str, Dict[str, Any]] = {}
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") == MANIFEST_VERSION:
+            self.sources = data.get("sources", {})
+
+    def source(self, acb_path: str) -> Dict[str, Any]:
+        return self.sources.get(os.path.abspath(acb_path), {})
+
+    def set_source(self, acb_path: str, record: Dict[str, Any]):
+        self.sources[os.path.abspath(acb_path)] = record
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run can't leave
+        # a truncated manifest behind.
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "sources": self.sources}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+def output_matches(path: str, record: Optional[Dict[str, Any]]) -> bool:
+    """ Whether the output file at path is still what we wrote last time. """
+    if not record:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == record.get("output_size") and st.st_mtime_ns == record.get("output_mtime_ns")
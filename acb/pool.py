@@ -0,0 +1,187 @@
+# pool.py: keep ACBFiles open between uses, within limits
+
+import collections
+import os
+import threading
+from collections import namedtuple as T
+from typing import Dict, List, Optional, Tuple
+
+from .acb import ACBFile, AFSArchive, find_awb
+from .disarm import DisarmContext
+from .manifest import file_identity
+
+pool_info_t = T("pool_info_t", ("hits", "misses", "evictions", "open", "in_use", "memory"))
+
+# Rough per-object costs for estimate_memory, in bytes.
+_TRACK_COST = 300
+_AFS_ENTRY_COST = 200
+_DISARM_COST = 1024
+_BASE_COST = 4096
+
+def estimate_memory(acb: ACBFile) -> int:
+    """ Approximate number of bytes an open ACBFile is holding on to: the
+        track list, the entries of archives that have been opened, and key
+        tables. Mapped files live in the page cache and aren't counted. """
+    total = _BASE_COST + len(acb.track_list.tracks) * _TRACK_COST
+    for archive in (acb._embedded_awb, acb._external_awb):
+        if isinstance(archive, AFSArchive):
+            total += len(archive.files) * _AFS_ENTRY_COST
+    for disarm in (acb.embedded_disarm, acb.external_disarm):
+        if isinstance(disarm, DisarmContext):
+            total += _DISARM_COST
+    return total
+
+def _close_all(files: List[ACBFile]):
+    for acb in files:
+        acb.close()
+
+class _Entry(object):
+    def __init__(self, key, acb: ACBFile, identity):
+        self.key = key
+        self.acb = acb
+        self.identity = identity
+        self.users = 0
+        self.evicted = False
+        self.memory = estimate_memory(acb)
+
+class Lease(object):
+    """ An ACBFile borrowed from an ACBPool. Use as a context manager, or call
+        release() when done. The ACBFile must not be used after that. """
+    def __init__(self, pool: "ACBPool", entry: _Entry):
+        self.pool = pool
+        self.entry = entry
+        self.acb = entry.acb
+        # (ACB, AWB) size and mtime when the file was opened.
+        self.identity = entry.identity
+
+    def release(self):
+        if self.entry is not None:
+            self.pool._release(self.entry)
+            self.entry = None
+
+    def __enter__(self) -> ACBFile:
+        return self.acb
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+class ACBPool(object):
+    """ A cache of open ACBFiles for long-running programs, so hot files stay
+        parsed and open without letting file handles and memory grow without
+        bound.
+
+        Files are borrowed with lease(), keyed by (path, AWB path, keys,
+        encoding). When there are more than max_open files open, or their
+        estimated memory (see estimate_memory) goes over max_memory, the least
+        recently used ones are evicted and closed. A file that's evicted while
+        leased is closed when the last lease is released. If a file changes on
+        disk (size or mtime), the next lease reopens it.
+
+        - acb_options: extra keyword arguments for ACBFile (e.g. use_mmap=True).
+    """
+    def __init__(self, max_open: int = 64, max_memory: Optional[int] = 256 << 20, **acb_options):
+        self.max_open = max_open
+        self.max_memory = max_memory
+        self.acb_options = acb_options
+        self.entries: Dict[Tuple, _Entry] = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lease(self, acb_path: str, extern_awb: Optional[str] = None, hca_keys: Optional[str] = None,
+            encoding: Optional[str] = None) -> Lease:
+        """ Borrow an ACBFile for acb_path, opening it if needed. If extern_awb
+            is None, it's looked for next to the ACB (see find_awb). """
+        acb_path = os.path.abspath(acb_path)
+        if extern_awb is None:
+            extern_awb = find_awb(acb_path)
+        key = (acb_path, extern_awb, hca_keys, encoding)
+        identity = (file_identity(acb_path), file_identity(extern_awb))
+
+        closing = []
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.identity != identity:
+                # The files changed on disk.
+                self._evict(entry, closing)
+                entry = None
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                entry.users += 1
+                return Lease(self, entry)
+            self.misses += 1
+        _close_all(closing)
+
+        # Open outside the lock so a slow file doesn't hold up everyone else.
+        # If two threads race to open the same file, the second one wins.
+        entry = _Entry(key, ACBFile(acb_path, extern_awb, hca_keys=hca_keys, encoding=encoding,
+            **self.acb_options), identity)
+        entry.users += 1
+        closing = []
+        with self.lock:
+            if key in self.entries:
+                self._evict(self.entries[key], closing)
+            self.entries[key] = entry
+            self.memory += entry.memory
+            self._trim(closing)
+        _close_all(closing)
+        return Lease(self, entry)
+
+    def _trim(self, closing: List[ACBFile]):
+        # Called with the lock held. Files in use count towards the limits but
+        # are only closed once released.
+        while self.entries and (len(self.entries) > self.max_open
+                or (self.max_memory is not None and self.memory > self.max_memory and len(self.entries) > 1)):
+            self._evict(next(iter(self.entries.values())), closing)
+
+    def _evict(self, entry: _Entry, closing: List[ACBFile]):
+        # Called with the lock held. Files to close are added to closing, for
+        # the caller to close once it lets go of the lock.
+        del self.entries[entry.key]
+        self.memory -= entry.memory
+        self.evictions += 1
+        entry.evicted = True
+        if entry.users == 0:
+            closing.append(entry.acb)
+
+    def _release(self, entry: _Entry):
+        closing = []
+        with self.lock:
+            entry.users -= 1
+            if entry.evicted:
+                if entry.users == 0:
+                    closing.append(entry.acb)
+            else:
+                # Archives and key tables are set up lazily, so the file may
+                # have grown while it was out.
+                memory = estimate_memory(entry.acb)
+                self.memory += memory - entry.memory
+                entry.memory = memory
+                self._trim(closing)
+        _close_all(closing)
+
+    def info(self) -> pool_info_t:
+        with self.lock:
+            return pool_info_t(self.hits, self.misses, self.evictions, len(self.entries),
+                sum(1 for e in self.entries.values() if e.users), self.memory)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        """ Evict everything. Leased files are closed when they're released. """
+        closing = []
+        with self.lock:
+            for entry in list(self.entries.values()):
+                self._evict(entry, closing)
+        _close_all(closing)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,240 @@
+# server.py: serve tracks straight out of ACB/AWB files over HTTP
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import weakref
+import zlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from .acb import ACBFile, WAVEFORM_ENCODE_TYPE_HCA, name_gen_default, track_t
+from .batch import iter_acb_files
+from .pool import ACBPool
+
+class _TrackIndex(object):
+    """ Cue name and id lookups for one ACBFile. """
+    def __init__(self, acb: ACBFile):
+        self.by_name: Dict[str, track_t] = {}
+        self.by_id: Dict[int, track_t] = {}
+        for track in acb.track_list.tracks:
+            self.by_name.setdefault(track.name, track)
+            self.by_id.setdefault(track.cue_id, track)
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """ Parse a Range header into (start, end), end exclusive. Returns None
+        for anything but a single byte range, which means "send everything".
+        ValueError is raised if the range can't be satisfied. """
+    m = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+
+    if not m.group(1):
+        # Suffix range: the last n bytes.
+        start, end = max(0, size - int(m.group(2))), size
+    else:
+        start = int(m.group(1))
+        end = min(size, int(m.group(2)) + 1) if m.group(2) else size
+    if start >= end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """ Whether an If-None-Match header (a list of tags, or *) matches etag.
+        Weak tags compare equal to strong ones, as If-None-Match asks. """
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+class ACBRequestHandler(BaseHTTPRequestHandler):
+    """ Routes:
+        - /: JSON list of the ACB files under the root directory.
+        - /<path to acb>: JSON list of the tracks in it.
+        - /<path to acb>/file/<cue name or id>: the track data. Supports
+          single byte ranges and ETag/If-None-Match.
+    """
+    server_version = "acb.py"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def handle_request(self, send_body):
+        path = unquote(urlsplit(self.path).path).strip("/")
+        acb_rel, sep, cue = path.partition("/file/")
+
+        if not path:
+            root = self.server.root
+            listing = [os.path.relpath(p, root).replace(os.sep, "/") for p, _ in iter_acb_files([root])]
+            return self.send_json(listing, send_body)
+
+        acb_path = self.resolve_acb(acb_rel)
+        if acb_path is None:
+            return self.send_error(HTTPStatus.NOT_FOUND, "No such ACB")
+
+        try:
+            lease = self.server.pool.lease(acb_path, hca_keys=self.server.hca_keys, encoding=self.server.encoding)
+            with lease as acb:
+                if not sep:
+                    return self.send_json([{
+                        "cue_id": t.cue_id, "name": t.name, "enc_type": t.enc_type, "is_stream": bool(t.is_stream),
+                        "url": "/{0}/file/{1}".format(quote(acb_rel), quote(t.name)),
+                    } for t in acb.track_list.tracks], send_body)
+
+                index = self.server.track_index(acb)
+                track = index.by_name.get(cue)
+                if track is None and cue.isdigit():
+                    track = index.by_id.get(int(cue))
+                if track is None:
+                    return self.send_error(HTTPStatus.NOT_FOUND, "No such cue")
+
+                self.send_track(acb, lease.identity, track, send_body)
+        except ConnectionError:
+            # The client went away (e.g. a player cancelling a range request).
+            self.close_connection = True
+        except (OSError, ValueError, RuntimeError) as e:
+            # RuntimeError is TrackList's complaint about ACBs it can't handle.
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+
+    def resolve_acb(self, rel: str) -> Optional[str]:
+        root = self.server.root
+        path = os.path.realpath(os.path.join(root, rel))
+        # Don't let ../ or symlinks wander outside the root.
+        try:
+            if os.path.commonpath([root, path]) != root:
+                return None
+        except ValueError:
+            # On another drive (Windows).
+            return None
+        if not path.endswith(".acb") or not os.path.isfile(path):
+            return None
+        return path
+
+    def send_json(self, obj, send_body):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_track(self, acb: ACBFile, identity, track: track_t, send_body):
+        # Only HCAs can be decrypted; anything else is served as is.
+        disarm = None if track.enc_type == WAVEFORM_ENCODE_TYPE_HCA else False
+        archive, afs_entry, disarmer, mapped = acb._locate(track, disarm)
+        # Where the track is in the archive pins down its contents, as long as
+        # the files haven't changed.
+        etag = '"{0}-{1:x}-{2:x}-{3:08x}-{4}"'.format("s" if track.is_stream else "m", afs_entry.offset,
+            afs_entry.size, zlib.crc32(repr(identity).encode("utf-8")), "d" if disarmer else "r")
+
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        size = afs_entry.size
+        byte_range = None
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", "bytes */{0}".format(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        start, end = byte_range or (0, size)
+        if not send_body:
+            body = b""
+        elif disarmer:
+            body = acb.get_track_data(track, disarm, unmask=not self.server.no_unmask)[start:end]
+        else:
+            # Nothing to decrypt, so only read what was asked for.
+            body = archive.file_data_range(afs_entry, start, end - start)
+
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Disposition", "inline; filename*=UTF-8''{0}".format(quote(name_gen_default(track))))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end - start))
+        if byte_range:
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end - 1, size))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+class ACBServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server for the ACBs under root. See ACBRequestHandler for the
+        routes. Tracks are read (and decrypted with hca_keys, if given) on
+        demand, from up to max_open ACBFiles kept open at once. """
+    daemon_threads = True
+
+    def __init__(self, address, root: str, hca_keys: Optional[str] = None, no_unmask: bool = False,
+            encoding: Optional[str] = None, max_open: int = 32, quiet: bool = False):
+        super().__init__(address, ACBRequestHandler)
+        self.root = os.path.realpath(root)
+        self.no_unmask = no_unmask
+        self.quiet = quiet
+        self.hca_keys = hca_keys
+        self.encoding = encoding
+        self.pool = ACBPool(max_open)
+        self.track_indexes: "weakref.WeakKeyDictionary[ACBFile, _TrackIndex]" = weakref.WeakKeyDictionary()
+        self.track_indexes_lock = threading.Lock()
+
+    def track_index(self, acb: ACBFile) -> _TrackIndex:
+        """ Cue lookups for acb, built once per open file. They go away with
+            the ACBFile when the pool drops it. """
+        with self.track_indexes_lock:
+            index = self.track_indexes.get(acb)
+            if index is None:
+                index = self.track_indexes[acb] = _TrackIndex(acb)
+            return index
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="acbextract serve",
+        description="Serve tracks from a directory of ACB files over HTTP, without extracting them first.")
+    parser.add_argument("--disarm-with", help="decrypt HCAs with provided keys")
+    parser.add_argument("--no-unmask", action="store_true", default=False,
+        help="don't unmask segment names (requires --disarm-with)")
+    parser.add_argument("--encoding", default=None, help="files' encoding")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="port to listen on (default 8000)")
+    parser.add_argument("--max-open", type=int, default=32, help="number of ACB files to keep open (default 32)")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False, help="don't log requests")
+    parser.add_argument("root", help="directory containing ACB (and AWB) files")
+
+    args = parser.parse_args(argv)
+
+    server = ACBServer((args.host, args.port), args.root, args.disarm_with, args.no_unmask, args.encoding,
+        args.max_open, args.quiet)
+    print("Serving {0} on http://{1}:{2}/".format(server.root, *server.server_address[:2]), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,66 @@
+# sidecar.py: precomputed indexes, so ACBFile can skip parsing files it's seen before
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from .manifest import file_identity
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+
+def index_path(acb_path: str, location: str) -> str:
+    """ Where the index for acb_path lives. location is either the index
+        file itself, or a directory to keep indexes for many files in (named
+        after a hash of the ACB's absolute path). """
+    if os.path.isdir(location):
+        key = hashlib.sha1(os.path.abspath(acb_path).encode("utf-8")).hexdigest()
+        return os.path.join(location, key + INDEX_SUFFIX)
+    return location
+
+def archive_record(archive) -> Optional[Dict[str, Any]]:
+    if archive is None:
+        return None
+    return {
+        "alignment": archive.alignment,
+        "mix_key": archive.mix_key,
+        "offset_size": archive.offset_size,
+        "files": [list(f) for f in archive.files],
+    }
+
+def load_index(path: str, acb_path: str, awb_path: Optional[str], encoding: Optional[str],
+        need_archives: bool = True) -> Optional[Dict[str, Any]]:
+    """ Read the index at path. Returns None if there isn't one, or it
+        doesn't match the files (size and mtime), the requested encoding, or
+        is missing the AFS2 entries and need_archives is True. """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(record, dict) or record.get("version") != INDEX_VERSION:
+        return None
+    if record.get("acb") != file_identity(acb_path) or record.get("awb") != file_identity(awb_path):
+        return None
+    if encoding is not None and record.get("encoding") != encoding:
+        return None
+    if need_archives and "embedded_awb" not in record:
+        return None
+    return record
+
+def save_index(path: str, record: Dict[str, Any]):
+    """ Write an index. Failing to write one isn't an error worth stopping
+        for, so OSError is swallowed. """
+    record = dict(record, version=INDEX_VERSION)
+    tmp = "{0}.{1}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, separators=(",", ":"), ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
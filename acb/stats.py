@@ -0,0 +1,116 @@
+# stats.py: timing and byte counts for ACBFile and extract_acb
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Phases recorded by ACBFile and extract_acb:
+# - parse: reading the ACB's @UTF tables and building the track list
+# - index: reading AFS2 archive headers
+# - key_table: setting up DisarmContexts (deriving key tables)
+# - read: reading track data out of the archives
+# - disarm: decrypting track data
+# - write: writing output files (extract_acb and ACBFile.write_track)
+PHASES = ("parse", "index", "key_table", "read", "disarm", "write")
+
+class _Phase(object):
+    __slots__ = ("stats", "name", "nbytes", "start")
+
+    def __init__(self, stats, name, nbytes):
+        self.stats = stats
+        self.name = name
+        self.nbytes = nbytes
+
+    def add(self, nbytes: int):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stats.add_phase(self.name, time.perf_counter() - self.start, self.nbytes)
+
+class _NoPhase(object):
+    __slots__ = ()
+
+    def add(self, nbytes: int):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+NO_PHASE = _NoPhase()
+
+def phase(stats: Optional["Stats"], name: str, nbytes: int = 0):
+    """ stats.phase(name, nbytes), or a context manager that does nothing if
+        stats is None. """
+    if stats is None:
+        return NO_PHASE
+    return stats.phase(name, nbytes)
+
+class Stats(object):
+    """ Collects where time goes while reading an ACB. Pass one to ACBFile or
+        extract_acb as stats=.
+
+        For each phase (see PHASES), the total wall time, number of calls and
+        bytes processed are kept. Phases can overlap (e.g. read and disarm
+        inside write) and, with several workers, run concurrently, so their
+        times don't add up to the elapsed time. Each track fetched through
+        get_track_data or write_track also gets an entry in .tracks.
+
+        - observer: if given, called as observer(phase, seconds, nbytes)
+            each time a phase finishes, from whatever thread ran it.
+    """
+    def __init__(self, observer: Optional[Callable[[str, float, int], None]] = None):
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self.tracks: List[Dict[str, Any]] = []
+        self.disarm_backend: Optional[str] = None
+
+    def phase(self, name: str, nbytes: int = 0) -> _Phase:
+        """ Context manager timing one occurrence of a phase. Bytes can be
+            given up front or added with .add() on the returned object. """
+        return _Phase(self, name, nbytes)
+
+    def add_phase(self, name: str, seconds: float, nbytes: int = 0):
+        with self.lock:
+            record = self.phases.get(name)
+            if record is None:
+                record = self.phases[name] = {"seconds": 0.0, "calls": 0, "bytes": 0}
+            record["seconds"] += seconds
+            record["calls"] += 1
+            record["bytes"] += nbytes
+
+        if self.observer:
+            self.observer(name, seconds, nbytes)
+
+    def add_track(self, name: str, cue_id: int, seconds: float, nbytes: int, disarm_backend: Optional[str]):
+        with self.lock:
+            self.tracks.append({"name": name, "cue_id": cue_id, "seconds": seconds, "bytes": nbytes,
+                "disarm": disarm_backend})
+            if disarm_backend:
+                self.disarm_backend = disarm_backend
+
+    def finish(self):
+        """ Stop the clock for .elapsed. Called by extract_acb when it's done. """
+        self.elapsed = time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "elapsed": self.elapsed if self.elapsed is not None else time.perf_counter() - self.started,
+                "disarm_backend": self.disarm_backend,
+                "phases": {k: dict(v) for k, v in self.phases.items()},
+                "tracks": [dict(t) for t in self.tracks],
+            }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.as_dict(), **kwargs)
@@ -44,9 +44,19 @@
 # OTHER DEALINGS IN THE SOFTWARE.
 
 import struct
-import functools
+import mmap
+import io
+import itertools
 import os
+import sys
+import threading
 from collections import namedtuple as T
+from collections.abc import Mapping, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 BYTE_ZERO = 0
 def JOIN_BYTE_ARRAY(sr):
@@ -70,8 +80,38 @@ def readfunc(fmt):
 def latebinder(f):
     return lambda s: f(s.f)
 
+def bufferfunc(fmt):
+    a = struct.Struct(fmt)
+    b = a.size
+    def f(s, at=None):
+        if at is not None:
+            return a.unpack_from(s.view, at)[0]
+        d = a.unpack_from(s.view, s.pos)[0]
+        s.pos += b
+        return d
+
+    return f
+
+_pread = getattr(os, "pread", None)
+_preadv = getattr(os, "preadv", None)
+
+def preadfunc(fmt):
+    a = struct.Struct(fmt)
+    b = a.size
+    def f(s, at=None):
+        if at is not None:
+            return a.unpack(s.pread(b, at))[0]
+        d = a.unpack(s.pread(b, s.pos))[0]
+        s.pos += b
+        return d
+
+    return f
+
 class R(object):
     """ file reader based on types """
+    # Whether reads with at= can be made from several threads at once.
+    threadsafe = False
+
     def __init__(self, file, *, encoding="utf-8"):
         self.f = file
         self.encoding = encoding
@@ -141,27 +181,324 @@ class R(object):
             return d
 
         bk = self.f.tell()
-        tl = 0
-        sr = []
+        chunks = []
         while 1:
-            b = self.f.read(16)
-            tl += len(b)
-
+            b = self.f.read(64)
             if len(b) == 0:
                 raise Exception("EOF")
 
-            for c in b:
-                if c != BYTE_ZERO:
-                    sr.append(c)
-                else:
-                    break
-            else:
-                continue
-            break
-        string = JOIN_BYTE_ARRAY(sr)
+            z = b.find(b"\0")
+            if z != -1:
+                chunks.append(b[:z])
+                break
+            chunks.append(b)
+
+        string = b"".join(chunks)
         self.f.seek(bk + len(string) + 1)
         return string.decode(self.encoding)
 
+class BufferR(R):
+    """ R, but over an in-memory buffer (bytes, mmap, memoryview...) instead
+        of a file. bytes() hands out memoryview slices of the buffer rather
+        than copies, so this is zero-copy when the buffer is a mapped file. """
+    threadsafe = True
+
+    def __init__(self, buffer, *, encoding="utf-8"):
+        self.f = buffer
+        self.view = memoryview(buffer)
+        if self.view.format != "B" or self.view.ndim != 1:
+            self.view = self.view.cast("B")
+        self.pos = 0
+        self.encoding = encoding
+
+    int8_t    = bufferfunc(">b")
+    uint8_t   = bufferfunc(">B")
+    int16_t   = bufferfunc(">h")
+    uint16_t  = bufferfunc(">H")
+    int32_t   = bufferfunc(">i")
+    uint32_t  = bufferfunc(">I")
+    int64_t   = bufferfunc(">q")
+    uint64_t  = bufferfunc(">Q")
+    float32_t = bufferfunc(">f")
+
+    le_int8_t    = bufferfunc("<b")
+    le_uint8_t   = bufferfunc("<B")
+    le_int16_t   = bufferfunc("<h")
+    le_uint16_t  = bufferfunc("<H")
+    le_int32_t   = bufferfunc("<i")
+    le_uint32_t  = bufferfunc("<I")
+    le_int64_t   = bufferfunc("<q")
+    le_uint64_t  = bufferfunc("<Q")
+    le_float32_t = bufferfunc("<f")
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, at, where=os.SEEK_SET):
+        if where == os.SEEK_CUR:
+            at += self.pos
+        elif where == os.SEEK_END:
+            at += len(self.view)
+        self.pos = at
+
+    def struct(self, struct, at=None):
+        if at is not None:
+            return struct.unpack(self.view[at:at + struct.size])
+
+        d = struct.unpack(self.view[self.pos:self.pos + struct.size])
+        self.pos += struct.size
+        return d
+
+    def bytes(self, size, at=None):
+        if at is not None:
+            return self.view[at:at + size]
+
+        d = self.view[self.pos:self.pos + size]
+        self.pos += len(d)
+        return d
+
+    def bytesinto(self, inbuf, at=None):
+        start = self.pos if at is None else at
+        d = self.view[start:start + len(inbuf)]
+        inbuf[:len(d)] = d
+        if at is None:
+            self.pos += len(d)
+
+    def string0(self, at=None):
+        start = self.pos if at is None else at
+        end = start
+        while 1:
+            chunk = self.view[end:end + 64].tobytes()
+            if len(chunk) == 0:
+                raise Exception("EOF")
+
+            z = chunk.find(b"\0")
+            if z != -1:
+                end += z
+                break
+            end += len(chunk)
+
+        if at is None:
+            self.pos = end + 1
+        return self.view[start:end].tobytes().decode(self.encoding)
+
+class PR(R):
+    """ R, but reads with os.pread on the file's descriptor instead of
+        seeking the file object, so there's no shared cursor: the file's own
+        position is never touched, and reads with at= can be made from many
+        threads at once. (Reads without at= still move this reader's
+        position, so a PR shouldn't be walked from two threads.)
+
+        Positions are relative to base, and reads stop at base + size if size
+        is given, which is how a FileWindow is read. """
+    threadsafe = True
+
+    def __init__(self, file, *, encoding="utf-8", base=0, size=None, pos=None):
+        self.f = file
+        self.fd = file.fileno()
+        self.base = base
+        self.limit = size
+        self.pos = file.tell() - base if pos is None else pos
+        self.encoding = encoding
+
+    int8_t    = preadfunc(">b")
+    uint8_t   = preadfunc(">B")
+    int16_t   = preadfunc(">h")
+    uint16_t  = preadfunc(">H")
+    int32_t   = preadfunc(">i")
+    uint32_t  = preadfunc(">I")
+    int64_t   = preadfunc(">q")
+    uint64_t  = preadfunc(">Q")
+    float32_t = preadfunc(">f")
+
+    le_int8_t    = preadfunc("<b")
+    le_uint8_t   = preadfunc("<B")
+    le_int16_t   = preadfunc("<h")
+    le_uint16_t  = preadfunc("<H")
+    le_int32_t   = preadfunc("<i")
+    le_uint32_t  = preadfunc("<I")
+    le_int64_t   = preadfunc("<q")
+    le_uint64_t  = preadfunc("<Q")
+    le_float32_t = preadfunc("<f")
+
+    def pread(self, size, at):
+        if self.limit is not None:
+            size = max(0, min(size, self.limit - at))
+        at += self.base
+        d = os.pread(self.fd, size, at)
+        if len(d) == size or not d:
+            return d
+
+        # Short read; keep going until EOF.
+        chunks = [d]
+        while size > len(d):
+            size -= len(d)
+            at += len(d)
+            d = os.pread(self.fd, size, at)
+            if not d:
+                break
+            chunks.append(d)
+        return b"".join(chunks)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, at, where=os.SEEK_SET):
+        if where == os.SEEK_CUR:
+            at += self.pos
+        elif where == os.SEEK_END:
+            at += self.limit if self.limit is not None else os.fstat(self.fd).st_size - self.base
+        self.pos = at
+
+    def struct(self, struct, at=None):
+        if at is not None:
+            return struct.unpack(self.pread(struct.size, at))
+
+        d = struct.unpack(self.pread(struct.size, self.pos))
+        self.pos += struct.size
+        return d
+
+    def bytes(self, size, at=None):
+        if at is not None:
+            return self.pread(size, at)
+
+        d = self.pread(size, self.pos)
+        self.pos += len(d)
+        return d
+
+    def bytesinto(self, inbuf, at=None):
+        start = self.pos if at is None else at
+        view = memoryview(inbuf).cast("B")
+        size = len(view)
+        if self.limit is not None:
+            size = max(0, min(size, self.limit - start))
+
+        done = 0
+        while done < size:
+            if _preadv is not None:
+                n = _preadv(self.fd, [view[done:size]], self.base + start + done)
+            else:
+                d = os.pread(self.fd, size - done, self.base + start + done)
+                n = len(d)
+                view[done:done + n] = d
+            if not n:
+                break
+            done += n
+
+        if at is None:
+            self.pos += done
+
+    def string0(self, at=None):
+        start = self.pos if at is None else at
+        chunks = []
+        end = start
+        while 1:
+            chunk = self.pread(64, end)
+            if len(chunk) == 0:
+                raise Exception("EOF")
+
+            z = chunk.find(b"\0")
+            if z != -1:
+                chunks.append(chunk[:z])
+                end += z
+                break
+            chunks.append(chunk)
+            end += len(chunk)
+
+        if at is None:
+            self.pos = end + 1
+        return b"".join(chunks).decode(self.encoding)
+
+def os_file_fd(f):
+    """ f's descriptor if f is an OS file (io.FileIO, or a buffered file
+        around one), so that reading the descriptor gives the same bytes as
+        reading f. Otherwise None: wrappers like gzip.GzipFile have a
+        fileno() too, but it belongs to the file underneath. """
+    if not isinstance(getattr(f, "raw", f), io.FileIO):
+        return None
+    try:
+        return f.fileno()
+    except (ValueError, io.UnsupportedOperation):
+        # Closed.
+        return None
+
+def _pread_fd(f):
+    """ f's descriptor if it can be read with os.pread, otherwise None. """
+    if _pread is None:
+        # e.g. Windows
+        return None
+    fd = os_file_fd(f)
+    try:
+        return fd if fd is not None and f.seekable() else None
+    except (ValueError, io.UnsupportedOperation):
+        return None
+
+class FileWindow(object):
+    """ Read-only file object for size bytes at offset in another file, e.g.
+        an AWB embedded in an ACB. If the file has a descriptor, reads use
+        os.pread and leave its position alone; otherwise they seek it every
+        time, which isn't safe to share between threads without a lock.
+        make_reader turns a window into a PR, where it can. """
+    def __init__(self, f, offset: int, size: int):
+        self.f = f
+        self.fd = _pread_fd(f)
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, at: int, where: int = os.SEEK_SET) -> int:
+        if where == os.SEEK_CUR:
+            at += self.pos
+        elif where == os.SEEK_END:
+            at += self.size
+        self.pos = max(0, at)
+        return self.pos
+
+    def read(self, size: int = -1) -> bytes:
+        avail = max(0, self.size - self.pos)
+        if size < 0 or size > avail:
+            size = avail
+        if self.fd is not None:
+            d = os.pread(self.fd, size, self.offset + self.pos)
+        else:
+            self.f.seek(self.offset + self.pos)
+            d = self.f.read(size)
+        self.pos += len(d)
+        return d
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        avail = max(0, self.size - self.pos)
+        if len(view) > avail:
+            view = view[:avail]
+        if self.fd is not None:
+            d = os.pread(self.fd, len(view), self.offset + self.pos)
+            n = len(d)
+            view[:n] = d
+        else:
+            self.f.seek(self.offset + self.pos)
+            n = self.f.readinto(view) or 0
+        self.pos += n
+        return n
+
+def make_reader(source, *, encoding="utf-8"):
+    """ Wrap source in the appropriate reader. source can be a binary file
+        object, a buffer (bytes, memoryview, mmap), or an existing reader.
+        Files that support os.pread get a PR, anything else an R. """
+    if isinstance(source, R):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return BufferR(source, encoding=encoding)
+    if isinstance(source, FileWindow):
+        if source.fd is not None:
+            return PR(source.f, encoding=encoding, base=source.offset, size=source.size, pos=source.pos)
+    elif _pread_fd(source) is not None:
+        return PR(source, encoding=encoding)
+    return R(source, encoding=encoding)
+
 class Struct(struct.Struct):
     """ struct with an output filter (usually a namedtuple) """
     def __init__(self, fmt, out_type):
@@ -223,78 +560,411 @@ column_data_stable = {
     COLUMN_TYPE_1BYTE2 : "b",
     COLUMN_TYPE_1BYTE  : "B"}
 
+# numpy dtypes for the row formats above. Data columns are an (offset, size)
+# pair, string columns are an offset into the string table.
+column_data_ntable = {
+    "8s" : [("offset", ">u4"), ("size", ">u4")],
+    "4s" : ">u4",
+    "f"  : ">f4",
+    "Q"  : ">u8",
+    "i"  : ">i4",
+    "I"  : ">u4",
+    "h"  : ">i2",
+    "H"  : ">u2",
+    "b"  : "i1",
+    "B"  : "u1"}
+
+# What UTFTable.columns() gives for data columns.
+data_span_dtype = [("offset", "u8"), ("size", "u4")]
+
 utf_header_t = Struct(">IHHIIIHHI",
     T("utf_header_t", ("table_size", "u1", "row_offset", "string_table_offset",
     "data_offset", "table_name_offset", "number_of_fields", "row_size", "number_of_rows")))
 
+# A table's schema, compiled. Shared by all tables laid out the same way, see
+# SchemaCache. constants are kept unresolved (strings and data as the raw
+# offsets), since what they point to differs between files.
+utf_schema_t = T("utf_schema_t", ("dynamic_keys", "struct_format", "constants",
+    "column_layout", "column_structs", "names"))
+
+# How columns are unpacked by UTFTable.read_column: strings as their offset,
+# data as (offset, size).
+column_unpack_formats = {"4s": "I", "8s": "II"}
+
+schema_cache_info_t = T("schema_cache_info_t", ("hits", "misses", "currsize", "maxsize"))
+
+class SchemaCache(object):
+    """ Compiled schemas, keyed by the raw schema bytes, table name and
+        encoding. Files from the same game tend to share a handful of
+        schemas, so after the first few tables, parsing a schema is just a
+        dict lookup.
+
+        Column names are offsets into the string table, so the same schema
+        bytes don't guarantee the same names. Each entry also keeps the start
+        of the string table up to the end of the last column name, which has
+        to match before the entry is used.
+    """
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.entries = {} # type: ignore
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key, strings):
+        for schema in self.entries.get(key, ()):
+            if strings[:len(schema.names)] == schema.names:
+                with self.lock:
+                    self.hits += 1
+                return schema
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def add(self, key, schema):
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.maxsize:
+                # Drop the oldest schema.
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = self.entries.get(key, ())[-3:] + (schema,)
+
+    def info(self) -> schema_cache_info_t:
+        return schema_cache_info_t(self.hits, self.misses, len(self.entries), self.maxsize)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+SCHEMA_CACHE = SchemaCache()
+
+def schema_cache_info() -> schema_cache_info_t:
+    """ Hit and miss counts for the shared schema cache. """
+    return SCHEMA_CACHE.info()
+
+class UTFRow(Mapping):
+    """ A row of a lazy UTFTable. Acts like the dict you'd get from a normal
+        UTFTable, but values are only read when their column is touched. """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        if key in self.table.constants:
+            return self.table.constants[key]
+        if key not in self.table.column_layout:
+            raise KeyError(key)
+        return self.table.column(key)[self.index]
+
+    def __iter__(self):
+        yield from (k for k in self.table.dynamic_keys if k not in self.table.constants)
+        yield from self.table.constants
+
+    def __len__(self):
+        return len(self.table.column_layout.keys() | self.table.constants.keys())
+
+    def __repr__(self):
+        return "<UTFRow {0} of '{1}'>".format(self.index, self.table.name)
+
+class UTFRows(Sequence):
+    """ The rows of a lazy UTFTable, as UTFRows made on demand. The table
+        doesn't keep this around (see UTFTable.rows), so tables and their
+        rows don't form reference cycles that would keep the file's buffers
+        alive until the garbage collector runs. """
+    __slots__ = ("table",)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.header.number_of_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [UTFRow(self.table, n) for n in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return UTFRow(self.table, index)
+
 class UTFTable(object):
-    def __init__(self, file, *, encoding="sjis"):
-        buf = R(file, encoding=encoding)
+    """ A CRI @UTF table.
+
+        By default, every row is read up front into a dict in .rows. If lazy is
+        True, only the schema is parsed; .rows holds UTFRow views and each
+        column is read (and its strings/data resolved) the first time it's
+        touched, then cached. The file must stay open while a lazy table is
+        in use.
+
+        The string table is read once, up front. Each string is decoded (and
+        interned) the first time it's looked up and cached by offset, so
+        strings shared by many rows are only decoded once.
+    """
+    def __init__(self, file, *, encoding="sjis", lazy=False):
+        buf = make_reader(file, encoding=encoding)
         magic = buf.uint32_t()
         if magic != 0x40555446:
             raise ValueError("bad magic")
 
         self.header = buf.struct(utf_header_t)
-        self.name = buf.string0(at=self.header.string_table_offset + 8 + self.header.table_name_offset)
         self.encoding = encoding
+        self.lazy = lazy
+        self.strings = bytes(buf.bytes(self.string_table_size(), at=self.header.string_table_offset + 8))
+        self.string_cache = {}
+        self.strings_decoded = False
+        self.name = self.get_string(self.header.table_name_offset)
 
         buf.seek(0x20)
         self.read_schema(buf)
 
-        buf.seek(self.header.row_offset + 8)
-        self.rows = list(self.iter_rows(buf))
+        self.src = buf
+        if lazy:
+            self.row_data = buf.bytes(self.header.row_size * self.header.number_of_rows,
+                at=self.header.row_offset + 8)
+            self.column_cache = {}
+        else:
+            buf.seek(self.header.row_offset + 8)
+            self.row_dicts = list(self.iter_rows(buf))
 
-    def read_schema(self, buf):
-        buf.seek(0x20)
+    @property
+    def rows(self):
+        return UTFRows(self) if self.lazy else self.row_dicts
 
+    def read_schema(self, buf):
+        h = self.header
+        raw = bytes(buf.bytes(h.row_offset + 8 - 0x20, at=0x20))
+        key = (raw, h.number_of_fields, h.row_size, self.name, self.encoding)
+
+        schema = SCHEMA_CACHE.lookup(key, self.strings)
+        if schema is None:
+            schema = self.compile_schema(raw, self.strings)
+            SCHEMA_CACHE.add(key, schema)
+
+        self.schema = schema
+        self.dynamic_keys = schema.dynamic_keys
+        self.struct_format = schema.struct_format
+        self.constants = {k: self.resolve_value(buf, v) for k, v in schema.constants}
+        self.column_layout = schema.column_layout
+
+    def compile_schema(self, raw: bytes, strings: bytes) -> utf_schema_t:
+        """ Interpret the schema bytes (everything between the header and the
+            rows). strings is the string table, for the column names. """
         dynamic_keys = []
         format = ">"
-        constants = {}
+        constants = []
+        # name -> (offset in row, struct format)
+        column_layout = {}
+        row_pos = 0
+        names_end = 0
+        pos = 0
 
         for _ in range(self.header.number_of_fields):
-            field_type = buf.uint8_t()
-            name_offset = buf.uint32_t()
+            field_type, name_offset = struct.unpack_from(">BI", raw, pos)
+            pos += 5
 
             occurrence = field_type & COLUMN_STORAGE_MASK
             type_key = field_type & COLUMN_TYPE_MASK
+            fmt = column_data_stable[type_key]
+            size = struct.calcsize(">" + fmt)
+
+            end = strings.index(b"\0", name_offset)
+            name = sys.intern(strings[name_offset:end].decode(self.encoding))
+            names_end = max(names_end, end + 1)
 
             if occurrence in (COLUMN_STORAGE_CONSTANT, COLUMN_STORAGE_CONSTANT2):
-                name = buf.string0(at=self.header.string_table_offset + 8 + name_offset)
-                val = column_data_dtable[type_key](buf)
-                constants[name] = val
+                val, = struct.unpack_from(">" + fmt, raw, pos)
+                pos += size
+                constants.append((name, val))
             else:
-                dynamic_keys.append(buf.string0(at=self.header.string_table_offset + 8 + name_offset))
-                format += column_data_stable[type_key]
-
-        for k in constants.keys():
-            if callable(constants[k]):
-                constants[k] = constants[k](self.header)
+                dynamic_keys.append(name)
+                format += fmt
+                column_layout[name] = (row_pos, fmt)
+                row_pos += size
+
+        # Each column gets a struct that skips over the rest of the row with
+        # pad bytes, so it can be pulled out in one iter_unpack call.
+        column_structs = {}
+        for name, (offset, fmt) in column_layout.items():
+            pad = self.header.row_size - offset - struct.calcsize(">" + fmt)
+            column_structs[name] = struct.Struct(">{0}x{1}{2}x".format(
+                offset, column_unpack_formats.get(fmt, fmt), pad))
+
+        return utf_schema_t(dynamic_keys, format, tuple(constants),
+            column_layout, column_structs, strings[:names_end])
+
+    def resolve_value(self, buf, val):
+        if isinstance(val, bytes):
+            if len(val) == 8:
+                offset, size = struct.unpack(">II", val)
+                return buf.bytes(size, at=self.header.data_offset + 8 + offset)
+            else:
+                return self.get_string(struct.unpack(">I", val)[0])
+        return val
+
+    def get_string(self, offset: int) -> str:
+        """ The string at offset in the string table. """
+        try:
+            return self.string_cache[offset]
+        except KeyError:
+            pass
+
+        end = self.strings.find(b"\0", offset)
+        if end == -1:
+            raise ValueError("unterminated string at offset {0}".format(offset))
+        value = self.string_cache[offset] = sys.intern(self.strings[offset:end].decode(self.encoding))
+        return value
+
+    def decode_strings(self):
+        """ Decode the whole string table at once and cache every string in
+            it, which is much cheaper than going one string at a time when
+            most of them are going to be used (e.g. cue names). """
+        if self.strings_decoded:
+            return
+        self.strings_decoded = True
+
+        raw = self.strings.split(b"\0")
+        try:
+            # NUL never shows up inside a multibyte character in the encodings
+            # CRI uses, so the pieces line up with the raw ones.
+            text = self.strings.decode(self.encoding).split("\0")
+        except UnicodeDecodeError:
+            # Could be junk that nothing points to. Leave it to get_string.
+            return
+        if len(text) != len(raw):
+            return
 
-        self.dynamic_keys = dynamic_keys
-        self.struct_format = format
-        self.constants = constants
+        offsets = itertools.accumulate(itertools.chain((0,), (len(r) + 1 for r in raw)))
+        decoded = dict(zip(offsets, map(sys.intern, text)))
+        decoded.update(self.string_cache)
+        self.string_cache = decoded
 
     def resolve(self, buf, *args):
-        ret = []
-        for val in args:
-            if isinstance(val, bytes):
-                if len(val) == 8:
-                    offset, size = struct.unpack(">II", val)
-                    ret.append(buf.bytes(size, at=self.header.data_offset + 8 + offset))
-                else:
-                    offset = struct.unpack(">I", val)[0]
-                    ret.append(buf.string0(at=self.header.string_table_offset + 8 + offset))
-            else:
-                ret.append(val)
-        return tuple(ret)
+        return tuple(self.resolve_value(buf, val) for val in args)
 
     def iter_rows(self, buf):
-        sfmt = Struct(self.struct_format, functools.partial(self.resolve, buf))
-        for n in range(self.header.number_of_rows):
-            values = buf.struct(sfmt)
-            ret = {k: v for k, v in zip(self.dynamic_keys, values)}
+        nrows = self.header.number_of_rows
+        row_data = buf.bytes(self.header.row_size * nrows)
+        # Decoding column by column is a lot faster than row by row.
+        columns = [self.read_column(buf, k, row_data) for k in self.dynamic_keys]
+        for values in (zip(*columns) if columns else itertools.repeat((), nrows)):
+            ret = dict(zip(self.dynamic_keys, values))
             ret.update(self.constants)
             yield ret
 
+    def read_column(self, buf, key, row_data):
+        """ Unpack and resolve one column out of row_data. """
+        fmt = self.column_layout[key][1]
+        unpacked = self.schema.column_structs[key].iter_unpack(row_data)
+        if fmt == "4s":
+            if self.header.number_of_rows > 16:
+                self.decode_strings()
+            get_string = self.get_string
+            return [get_string(offset) for offset, in unpacked]
+        elif fmt == "8s":
+            base = self.header.data_offset + 8
+            return [buf.bytes(size, at=base + offset) for offset, size in unpacked]
+        else:
+            return [v for v, in unpacked]
+
+    def column(self, key):
+        """ Get all values of a column as a list. For lazy tables, the column
+            is read and resolved on first use and cached afterwards. """
+        if key in self.constants:
+            return [self.constants[key]] * self.header.number_of_rows
+        if not self.lazy:
+            return [row[key] for row in self.rows]
+
+        values = self.column_cache.get(key)
+        if values is None:
+            values = self.column_cache[key] = self.read_column(self.src, key, self.row_data)
+
+        return values
+
+    def data_span(self, key, index=0):
+        """ Where the value of a data column is, as (offset, size) from the
+            start of the table, without reading it. """
+        for name, raw in self.schema.constants:
+            if name == key:
+                break
+        else:
+            offset, fmt = self.column_layout[key]
+            if fmt != "8s":
+                raise ValueError("{0} is not a data column".format(key))
+            if not 0 <= index < self.header.number_of_rows:
+                raise IndexError("row {0} out of range".format(index))
+            raw = self.src.bytes(8, at=self.header.row_offset + 8 + index * self.header.row_size + offset)
+
+        if not isinstance(raw, (bytes, memoryview)) or len(raw) != 8:
+            raise ValueError("{0} is not a data column".format(key))
+        offset, size = struct.unpack(">II", raw)
+        return self.header.data_offset + 8 + offset, size
+
+    def columns(self):
+        """ Decode the whole table column-wise with numpy. Returns a dict of
+            column name -> value, where dynamic columns are numpy arrays
+            (strings as object arrays) and constants are left as scalars.
+            Data columns aren't read: they become arrays of (offset, size)
+            records with data_span_dtype, offset being from the start of the
+            table, to slice out of the file as needed. Requires numpy, and
+            the file must still be open.
+        """
+        if numpy is None:
+            raise ImportError("UTFTable.columns() requires numpy")
+
+        nrows = self.header.number_of_rows
+        if self.lazy:
+            row_data = self.row_data
+        else:
+            row_data = self.src.bytes(self.header.row_size * nrows, at=self.header.row_offset + 8)
+
+        names = list(self.column_layout)
+        dtype = numpy.dtype({
+            "names": names,
+            "formats": [column_data_ntable[self.column_layout[k][1]] for k in names],
+            "offsets": [self.column_layout[k][0] for k in names],
+            "itemsize": self.header.row_size})
+        table = numpy.frombuffer(row_data, dtype=dtype, count=nrows)
+
+        ret = {}
+        for k in self.dynamic_keys:
+            if k in self.constants:
+                continue
+
+            fmt = self.column_layout[k][1]
+            col = table[k]
+            if fmt == "4s":
+                offsets, inverse = numpy.unique(col, return_inverse=True)
+                values = numpy.empty(len(offsets), dtype=object)
+                for i, off in enumerate(offsets.tolist()):
+                    values[i] = self.get_string(off)
+                ret[k] = values[inverse.reshape(-1)]
+            elif fmt == "8s":
+                # Resolving every blob would read e.g. a whole embedded AWB;
+                # hand out where they are instead, like data_span.
+                spans = numpy.empty(nrows, dtype=data_span_dtype)
+                spans["offset"] = col["offset"]
+                spans["offset"] += self.header.data_offset + 8
+                spans["size"] = col["size"]
+                ret[k] = spans
+            else:
+                ret[k] = col.astype(col.dtype.newbyteorder("="))
+
+        ret.update(self.constants)
+        return ret
+
+    def string_table_size(self) -> int:
+        start = self.header.string_table_offset
+        if self.header.data_offset > start:
+            return self.header.data_offset - start
+        return self.header.table_size - start
+
+    def string_table(self) -> bytes:
+        return self.strings
+
     def __repr__(self):
         return "<UTFTable '{1}' with {0} rows >".format(len(self.rows), self.name)
@@ -0,0 +1,49 @@
+""" Micro-benchmark for the checksum implementations in _acb_speedup.
+
+    python fast_sub/bench_checksum.py [--size N] [--seconds S]
+
+_acb_speedup needs to be built and importable.
+"""
+import argparse
+import os
+import time
+
+import _acb_speedup
+
+IMPLS = ("bytewise", "slice8", "clmul")
+
+def bench(impl, buf, seconds):
+    _acb_speedup.checksum_with(buf, impl)
+    n = 0
+    start = time.perf_counter()
+    while 1:
+        _acb_speedup.checksum_with(buf, impl)
+        n += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return n * len(buf) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, action="append",
+        help="buffer size in bytes (repeatable, default: a typical HCA block and 1 MiB)")
+    parser.add_argument("--seconds", type=float, default=0.5, help="time to spend on each case")
+    args = parser.parse_args()
+
+    print("default implementation:", _acb_speedup.checksum_impl)
+    for size in args.size or (0x400 - 2, 1 << 20):
+        buf = os.urandom(size)
+        expect = _acb_speedup.checksum_with(buf, "bytewise")
+        for impl in IMPLS:
+            try:
+                if _acb_speedup.checksum_with(buf, impl) != expect:
+                    raise AssertionError("{0} gave the wrong result".format(impl))
+            except ValueError:
+                print("{0:>8} bytes  {1:>8}  not available".format(size, impl))
+                continue
+
+            rate = bench(impl, buf, args.seconds)
+            print("{0:>8} bytes  {1:>8}  {2:8.1f} MB/s".format(size, impl, rate / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@
 
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
 
 // htons for win and mac
 #if defined(WIN32) || defined(_WIN32) || defined(__WIN32__) || defined(__NT__)
@@ -14,13 +15,19 @@
 #endif
 
 static PyObject *disarm_block_fast(PyObject *self, PyObject *args);
+static PyObject *disarm_blocks_fast(PyObject *self, PyObject *args);
 static PyObject *apply_checksum(PyObject *self, PyObject *args);
 static PyObject *checksum_ret(PyObject *self, PyObject *args);
+static PyObject *checksum_with(PyObject *self, PyObject *args);
+static PyObject *derive_key_table_fast(PyObject *self, PyObject *args);
 
 static const PyMethodDef fd_top_level[] = {
     {"disarm_block_fast", disarm_block_fast, METH_VARARGS, "Decrypt the data within a buffer object."},
+    {"disarm_blocks_fast", disarm_blocks_fast, METH_VARARGS, "Decrypt consecutive blocks of the given size within a buffer object."},
     {"checksum_block_fast", apply_checksum, METH_VARARGS, "Compute and append the checksum."},
     {"checksum_fast", checksum_ret, METH_VARARGS, "Compute and return the checksum of a block."},
+    {"derive_key_table_fast", derive_key_table_fast, METH_VARARGS, "Build the cipher type 56 substitution table for a key."},
+    {"checksum_with", checksum_with, METH_VARARGS, "Compute the checksum with a named implementation (bytewise, slice8 or clmul)."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -75,8 +82,7 @@ static const uint16_t CHECKSUM_TABLE[] = {
     0x8213, 0x0216, 0x021C, 0x8219, 0x0208, 0x820D, 0x8207, 0x0202
 };
 
-static uint16_t checksum(uint8_t *block, size_t len) {
-    uint16_t sum = 0;
+static uint16_t checksum_bytewise(const uint8_t *block, size_t len, uint16_t sum) {
     for (size_t i = 0; i < len; ++i) {
         sum = ((sum << 8) ^ CHECKSUM_TABLE[(sum >> 8) ^ block[i]]);
     }
@@ -84,14 +90,143 @@ static uint16_t checksum(uint8_t *block, size_t len) {
     return sum;
 }
 
+// Slicing-by-8: CHECKSUM_SLICE[k][v] is the checksum of byte v followed by
+// k zero bytes, so 8 bytes can be folded in with 8 independent lookups.
+// Filled in by exec_acb_speedup.
+static uint16_t CHECKSUM_SLICE[8][256];
+
+static void init_checksum_slice(void) {
+    for (int v = 0; v < 256; ++v) {
+        CHECKSUM_SLICE[0][v] = CHECKSUM_TABLE[v];
+    }
+
+    for (int k = 1; k < 8; ++k) {
+        for (int v = 0; v < 256; ++v) {
+            uint16_t prev = CHECKSUM_SLICE[k - 1][v];
+            CHECKSUM_SLICE[k][v] = (prev << 8) ^ CHECKSUM_TABLE[prev >> 8];
+        }
+    }
+}
+
+static uint16_t checksum_slice8(const uint8_t *b, size_t len, uint16_t sum) {
+    while (len >= 8) {
+        uint16_t c = sum ^ ((b[0] << 8) | b[1]);
+        sum = CHECKSUM_SLICE[7][c >> 8] ^ CHECKSUM_SLICE[6][c & 0xff]
+            ^ CHECKSUM_SLICE[5][b[2]] ^ CHECKSUM_SLICE[4][b[3]]
+            ^ CHECKSUM_SLICE[3][b[4]] ^ CHECKSUM_SLICE[2][b[5]]
+            ^ CHECKSUM_SLICE[1][b[6]] ^ CHECKSUM_SLICE[0][b[7]];
+        b += 8;
+        len -= 8;
+    }
+
+    return checksum_bytewise(b, len, sum);
+}
+
+// x^n mod P, where P is the checksum polynomial (x^16 + 0x8005).
+static uint16_t xpow_mod(int n) {
+    uint32_t r = 1;
+    while (n--) {
+        r <<= 1;
+        if (r & 0x10000) {
+            r ^= 0x18005;
+        }
+    }
+
+    return (uint16_t)r;
+}
+
+#if defined(__GNUC__) && defined(__x86_64__)
+#define HAVE_CHECKSUM_CLMUL 1
+#include <immintrin.h>
+
+// Carry-less multiply folding. The data is read 16 bytes at a time as a
+// big-endian 128-bit polynomial; folding a 128-bit remainder x forward by
+// n bits is x.hi * (x^(n+64) mod P) + x.lo * (x^n mod P), which keeps it
+// congruent to the message so far (mod P). The final 128-bit remainder is
+// then run through the table code, which gives the same checksum.
+static uint16_t FOLD_128[2];
+static uint16_t FOLD_512[2];
+
+static void init_checksum_clmul(void) {
+    FOLD_128[0] = xpow_mod(128);
+    FOLD_128[1] = xpow_mod(128 + 64);
+    FOLD_512[0] = xpow_mod(512);
+    FOLD_512[1] = xpow_mod(512 + 64);
+}
+
+__attribute__((target("pclmul,ssse3")))
+static inline __m128i fold(__m128i x, __m128i k) {
+    return _mm_xor_si128(_mm_clmulepi64_si128(x, k, 0x11), _mm_clmulepi64_si128(x, k, 0x00));
+}
+
+__attribute__((target("pclmul,ssse3")))
+static uint16_t checksum_clmul(const uint8_t *b, size_t len, uint16_t sum) {
+    if (len < 64) {
+        return checksum_slice8(b, len, sum);
+    }
+
+    const __m128i bswap = _mm_set_epi8(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15);
+    const __m128i k128 = _mm_set_epi64x(FOLD_128[1], FOLD_128[0]);
+    const __m128i k512 = _mm_set_epi64x(FOLD_512[1], FOLD_512[0]);
+
+    __m128i x0 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 0)), bswap);
+    __m128i x1 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 16)), bswap);
+    __m128i x2 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 32)), bswap);
+    __m128i x3 = _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 48)), bswap);
+    // The running sum is xored into the first 16 bits of the message.
+    x0 = _mm_xor_si128(x0, _mm_set_epi16((short)sum, 0, 0, 0, 0, 0, 0, 0));
+    b += 64;
+    len -= 64;
+
+    while (len >= 64) {
+        x0 = _mm_xor_si128(fold(x0, k512), _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 0)), bswap));
+        x1 = _mm_xor_si128(fold(x1, k512), _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 16)), bswap));
+        x2 = _mm_xor_si128(fold(x2, k512), _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 32)), bswap));
+        x3 = _mm_xor_si128(fold(x3, k512), _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)(b + 48)), bswap));
+        b += 64;
+        len -= 64;
+    }
+
+    x1 = _mm_xor_si128(x1, fold(x0, k128));
+    x2 = _mm_xor_si128(x2, fold(x1, k128));
+    x3 = _mm_xor_si128(x3, fold(x2, k128));
+
+    while (len >= 16) {
+        x3 = _mm_xor_si128(fold(x3, k128), _mm_shuffle_epi8(_mm_loadu_si128((const __m128i *)b), bswap));
+        b += 16;
+        len -= 16;
+    }
+
+    uint8_t rem[16];
+    _mm_storeu_si128((__m128i *)rem, _mm_shuffle_epi8(x3, bswap));
+    sum = checksum_slice8(rem, 16, 0);
+    return checksum_slice8(b, len, sum);
+}
+#endif
+
+typedef uint16_t (*checksum_fn)(const uint8_t *, size_t, uint16_t);
+// Picked at import time by exec_acb_speedup based on what the CPU supports.
+static checksum_fn checksum_impl = checksum_slice8;
+
+static uint16_t checksum(const uint8_t *block, size_t len) {
+    return checksum_impl(block, len, 0);
+}
+
+// All of the functions below drop the GIL while they work on the buffers,
+// so extracting with multiple threads actually runs in parallel.
+
 static PyObject *checksum_ret(PyObject *self, PyObject *args) {
     Py_buffer block;
+    uint16_t sum;
 
     if (!PyArg_ParseTuple(args, "y*", &block)) {
         return NULL;
     }
 
-    uint16_t sum = checksum(block.buf, block.len);
+    Py_BEGIN_ALLOW_THREADS
+    sum = checksum(block.buf, block.len);
+    Py_END_ALLOW_THREADS
+
     PyBuffer_Release(&block);
     return PyLong_FromUnsignedLong(sum);
 }
@@ -109,14 +244,26 @@ static PyObject *apply_checksum(PyObject *self, PyObject *args) {
         return NULL;
     }
 
+    Py_BEGIN_ALLOW_THREADS
     uint16_t sum = checksum(block.buf, block.len - 2);
     uint16_t *target = (uint16_t *)(((uint8_t *)block.buf) + block.len - 2);
     *target = htons(sum);
+    Py_END_ALLOW_THREADS
 
     PyBuffer_Release(&block);
     Py_RETURN_NONE;
 }
 
+static void disarm_block(uint8_t *e, Py_ssize_t len, const uint8_t *t) {
+    for (Py_ssize_t i = 0; i < len - 2; ++i) {
+        e[i] = t[e[i]];
+    }
+
+    uint16_t sum = checksum(e, len - 2);
+    uint16_t *target = (uint16_t *)(e + len - 2);
+    *target = htons(sum);
+}
+
 static PyObject *disarm_block_fast(PyObject *self, PyObject *args) {
     Py_buffer edata;
     Py_buffer keytab;
@@ -139,24 +286,178 @@ static PyObject *disarm_block_fast(PyObject *self, PyObject *args) {
         return NULL;
     }
 
-    uint8_t *t = (uint8_t *)keytab.buf;
-    uint8_t *e = (uint8_t *)edata.buf;
-    uint16_t sum = 0;
-    for (int i = 0; i < edata.len - 2; ++i) {
-        e[i] = t[e[i]];
-        sum = ((sum << 8) ^ CHECKSUM_TABLE[(sum >> 8) ^ e[i]]);
+    Py_BEGIN_ALLOW_THREADS
+    disarm_block(edata.buf, edata.len, keytab.buf);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&edata);
+    PyBuffer_Release(&keytab);
+    Py_RETURN_NONE;
+}
+
+static PyObject *disarm_blocks_fast(PyObject *self, PyObject *args) {
+    Py_buffer edata;
+    Py_buffer keytab;
+    Py_ssize_t block_size;
+
+    if (!PyArg_ParseTuple(args, "w*y*n", &edata, &keytab, &block_size)) {
+        return NULL;
     }
 
-    uint16_t *target = (uint16_t *)(e + edata.len - 2);
-    *target = htons(sum);
+    if (block_size < 2 || edata.len % block_size != 0) {
+        PyErr_SetString(PyExc_ValueError, "invalid size");
+        PyBuffer_Release(&edata);
+        PyBuffer_Release(&keytab);
+        return NULL;
+    }
+
+    if (keytab.len != 256) {
+        PyErr_SetString(PyExc_ValueError, "invalid substitution table");
+        PyBuffer_Release(&edata);
+        PyBuffer_Release(&keytab);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    uint8_t *e = (uint8_t *)edata.buf;
+    for (Py_ssize_t base = 0; base < edata.len; base += block_size) {
+        disarm_block(e + base, block_size, keytab.buf);
+    }
+    Py_END_ALLOW_THREADS
 
     PyBuffer_Release(&edata);
     PyBuffer_Release(&keytab);
     Py_RETURN_NONE;
 }
 
+static void small_rng(uint8_t seed, uint8_t *out) {
+    uint8_t a = ((seed & 1) << 3) | 0x5;
+    uint8_t c = (seed & 0xe) | 1;
+    seed >>= 4;
+
+    for (int i = 0; i < 16; ++i) {
+        seed = (seed * a + c) & 0xf;
+        out[i] = seed;
+    }
+}
+
+// Same as _derive_key_table_py in disarm.py.
+static void derive_key_table(uint32_t keya, uint32_t keyb, uint8_t *table) {
+    static const int s2_ri[] = {1, 2, 3, 4, 5, 6, 1};
+    static const int s2_li[] = {0, 6, 1, 2, 3, 4, 5};
+    uint8_t stage1[8] = {0};
+    uint8_t stage2[16];
+    uint8_t stage3[256];
+    uint8_t high[16], low[16];
+
+    // Unsigned wraparound does the rollover for us.
+    if (keya == 0) {
+        keyb -= 1;
+    }
+    keya -= 1;
+
+    for (int i = 0; i < 7; ++i) {
+        stage1[i] = keya & 0xff;
+        keya = (keya >> 8) | (keyb << 24);
+        keyb >>= 8;
+    }
+
+    for (int i = 0; i < 16; i += 3) {
+        stage2[i] = stage1[i / 3 + 1];
+    }
+
+    for (int i = 1; i < 16; i += 3) {
+        int j = i / 3 + 1;
+        stage2[i] = stage1[j] ^ stage1[s2_li[j]];
+    }
+
+    for (int i = 2; i < 16; i += 3) {
+        int j = i / 3 + 2;
+        stage2[i] = stage1[j] ^ stage1[s2_ri[j]];
+    }
+
+    small_rng(stage1[0], high);
+    for (int i = 0; i < 16; ++i) {
+        small_rng(stage2[i], low);
+        for (int j = 0; j < 16; ++j) {
+            stage3[16 * i + j] = (high[i] << 4) | low[j];
+        }
+    }
+
+    table[0x00] = 0;
+    table[0xff] = 0xff;
+    uint8_t srci = 0x11;
+    for (int i = 1; i < 255; ++i) {
+        while (stage3[srci] == 0x0 || stage3[srci] == 0xff) {
+            srci += 0x11;
+        }
+
+        table[i] = stage3[srci];
+        srci += 0x11;
+    }
+}
+
+static PyObject *derive_key_table_fast(PyObject *self, PyObject *args) {
+    unsigned long keya, keyb;
+    uint8_t table[256];
+
+    if (!PyArg_ParseTuple(args, "kk", &keya, &keyb)) {
+        return NULL;
+    }
+
+    derive_key_table((uint32_t)keya, (uint32_t)keyb, table);
+    return PyBytes_FromStringAndSize((const char *)table, sizeof(table));
+}
+
+// For benchmarking: run a specific checksum implementation.
+static PyObject *checksum_with(PyObject *self, PyObject *args) {
+    Py_buffer block;
+    const char *name;
+    checksum_fn fn;
+    uint16_t sum;
+
+    if (!PyArg_ParseTuple(args, "y*s", &block, &name)) {
+        return NULL;
+    }
+
+    if (strcmp(name, "bytewise") == 0) {
+        fn = checksum_bytewise;
+    } else if (strcmp(name, "slice8") == 0) {
+        fn = checksum_slice8;
+#ifdef HAVE_CHECKSUM_CLMUL
+    } else if (strcmp(name, "clmul") == 0 && checksum_impl == checksum_clmul) {
+        fn = checksum_clmul;
+#endif
+    } else {
+        PyErr_Format(PyExc_ValueError, "checksum implementation %s is not available", name);
+        PyBuffer_Release(&block);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    sum = fn(block.buf, block.len, 0);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&block);
+    return PyLong_FromUnsignedLong(sum);
+}
+
 static int exec_acb_speedup(PyObject *module) {
-    return 0;
+    const char *impl = "slice8";
+
+    init_checksum_slice();
+    checksum_impl = checksum_slice8;
+
+#ifdef HAVE_CHECKSUM_CLMUL
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("pclmul") && __builtin_cpu_supports("ssse3")) {
+        init_checksum_clmul();
+        checksum_impl = checksum_clmul;
+        impl = "clmul";
+    }
+#endif
+
+    return PyModule_AddStringConstant(module, "checksum_impl", impl);
 }
 
 PyMODINIT_FUNC PyInit__acb_speedup(void) {
@@ -0,0 +1,199 @@
+""" Benchmarks for acb.py, run against synthetic files from synth.py.
+
+    python tests/benchmark.py [--tracks N] [--blocks N] [--block-size N]
+        [--backend c|numpy|python|both|all] [--only NAME] [--json]
+
+Reports the best wall time of a few runs, throughput, and the peak memory
+allocated by Python during one more run (traced separately, because
+tracemalloc slows everything down). --backend picks the disarm
+implementations to compare: both is c and python, all adds numpy.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synth
+from acb import disarm, utf
+from acb.acb import ACBFile, AFSArchive, extract_acb
+
+KEY = "0x1234567890abcdef"
+MIX_KEY = 0x1111
+STREAM_MIX_KEY = 0x2222
+
+def make_files(workdir, tracks, blocks, block_size):
+    specs = synth.make_tracks(tracks, blocks, block_size, keyspec=KEY, mix_key=MIX_KEY,
+        stream_mix_key=STREAM_MIX_KEY)
+    acb, awb = synth.build_acb(specs, mix_key=MIX_KEY, stream_mix_key=STREAM_MIX_KEY)
+
+    acb_path = os.path.join(workdir, "bench.acb")
+    awb_path = os.path.join(workdir, "bench.awb")
+    with open(acb_path, "wb") as f:
+        f.write(acb)
+    with open(awb_path, "wb") as f:
+        f.write(awb)
+
+    hca = synth.build_hca(blocks * tracks, block_size, keyspec=KEY, mix_key=MIX_KEY)
+    return acb_path, awb_path, acb, awb, hca
+
+def bench_utf_parse(ctx):
+    def run():
+        table = utf.UTFTable(io.BytesIO(ctx["acb"]))
+        for name in ("CueTable", "CueNameTable", "WaveformTable", "SynthTable"):
+            utf.UTFTable(io.BytesIO(table.rows[0][name]))
+    return run, len(ctx["acb"])
+
+def bench_utf_parse_lazy(ctx):
+    def run():
+        table = utf.UTFTable(ctx["acb"], lazy=True)
+        for name in ("CueTable", "CueNameTable", "WaveformTable", "SynthTable"):
+            nested = utf.UTFTable(table.rows[0][name], lazy=True)
+            for key in nested.dynamic_keys:
+                nested.column(key)
+    return run, len(ctx["acb"])
+
+def bench_afs_index(ctx):
+    archive = AFSArchive(ctx["awb"])
+    cue_ids = [f.cue_id for f in archive.files]
+
+    def run():
+        archive = AFSArchive(ctx["awb"])
+        for cue_id in cue_ids:
+            archive.entry_for_cue_id(cue_id)
+    return run, len(ctx["awb"])
+
+def bench_disarm(ctx):
+    context = disarm.DisarmContext(KEY, MIX_KEY)
+
+    def run():
+        context.disarm(bytearray(ctx["hca"]))
+    return run, len(ctx["hca"])
+
+def bench_extract(ctx):
+    out = os.path.join(ctx["workdir"], "out")
+
+    def run():
+        shutil.rmtree(out, ignore_errors=True)
+        os.makedirs(out)
+        extract_acb(ctx["acb_path"], out, ctx["awb_path"], hca_keys=KEY)
+    return run, len(ctx["acb"]) + len(ctx["awb"])
+
+def bench_extract_threads(ctx):
+    out = os.path.join(ctx["workdir"], "out")
+
+    def run():
+        shutil.rmtree(out, ignore_errors=True)
+        os.makedirs(out)
+        extract_acb(ctx["acb_path"], out, ctx["awb_path"], hca_keys=KEY, workers=4)
+    return run, len(ctx["acb"]) + len(ctx["awb"])
+
+def bench_get_track_data(ctx):
+    acb = ACBFile(ctx["acb_path"], ctx["awb_path"], hca_keys=KEY)
+    ctx["cleanup"].append(acb.close)
+
+    def run():
+        for track in acb.track_list.tracks:
+            acb.get_track_data(track)
+    return run, len(ctx["acb"]) + len(ctx["awb"])
+
+BENCHMARKS = {
+    "utf_parse": bench_utf_parse,
+    "utf_parse_lazy": bench_utf_parse_lazy,
+    "afs_index": bench_afs_index,
+    "disarm": bench_disarm,
+    "get_track_data": bench_get_track_data,
+    "extract": bench_extract,
+    "extract_threads": bench_extract_threads,
+}
+
+def measure(run, repeat):
+    run()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+def set_backend(name, speedup):
+    disarm._acb_speedup = speedup if name == "c" else None
+    disarm.set_disarm_backend(name)
+    disarm.derive_key_table.cache_clear()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=32, help="number of tracks in the synthetic ACB")
+    parser.add_argument("--blocks", type=int, default=256, help="HCA blocks per track")
+    parser.add_argument("--block-size", type=int, default=0x400, help="HCA block size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark (best is reported)")
+    parser.add_argument("--backend", choices=("c", "numpy", "python", "both", "all"), default="both")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--json", action="store_true", default=False, help="print results as JSON")
+    args = parser.parse_args()
+
+    speedup = disarm._acb_speedup
+    backends = {"both": ["c", "python"], "all": ["c", "numpy", "python"]}.get(args.backend, [args.backend])
+    if "c" in backends and not speedup:
+        print("_acb_speedup isn't importable, skipping the C backend", file=sys.stderr)
+        backends.remove("c")
+    if "numpy" in backends and disarm.numpy is None:
+        print("NumPy isn't importable, skipping the numpy backend", file=sys.stderr)
+        backends.remove("numpy")
+
+    workdir = tempfile.mkdtemp(prefix="acb-bench-")
+    results = []
+    try:
+        acb_path, awb_path, acb, awb, hca = make_files(workdir, args.tracks, args.blocks, args.block_size)
+        for backend in backends:
+            set_backend(backend, speedup)
+            for name in args.only or BENCHMARKS:
+                ctx = dict(workdir=workdir, acb_path=acb_path, awb_path=awb_path, acb=acb, awb=awb, hca=hca,
+                    cleanup=[])
+                try:
+                    run, size = BENCHMARKS[name](ctx)
+                    seconds, peak = measure(run, args.repeat)
+                finally:
+                    for fn in ctx["cleanup"]:
+                        fn()
+
+                results.append(dict(benchmark=name, backend=backend, seconds=seconds, bytes=size,
+                    mb_per_s=size / 1e6 / seconds, peak_alloc=peak))
+                if not args.json:
+                    print("{0:>16} {1:>6}  {2:9.2f} ms  {3:9.1f} MB/s  peak {4:8.1f} KiB".format(
+                        name, backend, seconds * 1e3, size / 1e6 / seconds, peak / 1024))
+    finally:
+        disarm._acb_speedup = speedup
+        disarm.set_disarm_backend("auto")
+        disarm.derive_key_table.cache_clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        import resource
+    except ImportError:
+        maxrss = None
+    else:
+        # ru_maxrss is KiB on Linux, bytes on macOS.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.json:
+        print(json.dumps({"results": results, "max_rss": maxrss}, indent=1))
+    else:
+        print("max RSS:", maxrss)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+""" Generators for synthetic (but structurally valid) UTF tables, AFS2
+    archives, HCA files and ACBs. Used by the tests and benchmarks so we
+    don't have to ship real game assets. """
+
+import random
+import struct
+from collections import namedtuple as T
+
+from acb import utf
+from acb.disarm import DisarmContext, checksum
+
+# A column is (name, type_key, values). If values is not a list, the column
+# is written as a constant.
+column_t = T("column_t", ("name", "type_key", "values"))
+
+_NUMERIC_FORMATS = {
+    utf.COLUMN_TYPE_FLOAT:  ">f",
+    utf.COLUMN_TYPE_8BYTE:  ">Q",
+    utf.COLUMN_TYPE_4BYTE2: ">i",
+    utf.COLUMN_TYPE_4BYTE:  ">I",
+    utf.COLUMN_TYPE_2BYTE2: ">h",
+    utf.COLUMN_TYPE_2BYTE:  ">H",
+    utf.COLUMN_TYPE_1BYTE2: ">b",
+    utf.COLUMN_TYPE_1BYTE:  ">B",
+}
+
+
+def _align(n, a):
+    return (n + a - 1) & ~(a - 1)
+
+
+class _Pool(object):
+    def __init__(self, encoding):
+        self.strings = bytearray(b"<NULL>\x00")
+        self.string_offsets = {"<NULL>": 0}
+        self.data = bytearray()
+        self.encoding = encoding
+
+    def string(self, s):
+        if s not in self.string_offsets:
+            self.string_offsets[s] = len(self.strings)
+            self.strings += s.encode(self.encoding) + b"\x00"
+        return self.string_offsets[s]
+
+    def blob(self, b):
+        if not b:
+            return 0, 0
+        # CRI aligns nested tables in the data area
+        self.data += bytes(_align(len(self.data), 32) - len(self.data))
+        offset = len(self.data)
+        self.data += b
+        return offset, len(b)
+
+
+def _pack_value(pool, type_key, value):
+    if type_key == utf.COLUMN_TYPE_STRING:
+        return struct.pack(">I", pool.string(value))
+    elif type_key == utf.COLUMN_TYPE_DATA:
+        return struct.pack(">II", *pool.blob(bytes(value)))
+    else:
+        return struct.pack(_NUMERIC_FORMATS[type_key], value)
+
+
+def build_utf(name, columns, nrows=None, encoding="utf-8"):
+    """ Build a @UTF table. columns is a list of column_t. """
+    if nrows is None:
+        nrows = max((len(c.values) for c in columns if isinstance(c.values, list)), default=1)
+
+    pool = _Pool(encoding)
+    name_offset = pool.string(name)
+
+    schema = bytearray()
+    for col in columns:
+        const = not isinstance(col.values, list)
+        storage = utf.COLUMN_STORAGE_CONSTANT if const else utf.COLUMN_STORAGE_PERROW
+        schema += struct.pack(">BI", storage | col.type_key, pool.string(col.name))
+        if const:
+            schema += _pack_value(pool, col.type_key, col.values)
+
+    rows = bytearray()
+    row_size = 0
+    for i in range(nrows):
+        start = len(rows)
+        for col in columns:
+            if isinstance(col.values, list):
+                rows += _pack_value(pool, col.type_key, col.values[i])
+        row_size = len(rows) - start
+
+    row_offset = 0x18 + len(schema)
+    string_table_offset = row_offset + len(rows)
+    data_offset = _align(string_table_offset + len(pool.strings), 32)
+    table_size = data_offset + len(pool.data)
+
+    out = bytearray(struct.pack(">I", 0x40555446))
+    out += struct.pack(">IHHIIIHHI", table_size, 1, row_offset, string_table_offset,
+        data_offset, name_offset, len(columns), row_size, nrows)
+    out += schema
+    out += rows
+    out += pool.strings
+    out += bytes(data_offset + 8 - len(out))
+    out += pool.data
+    return bytes(out)
+
+
+def build_afs2(files, alignment=32, mix_key=0, cue_id_size=2, offset_size=4):
+    """ Build an AFS2 archive. files is a list of (cue_id, payload). """
+    id_fmt = {2: "H", 4: "I"}[cue_id_size]
+    off_fmt = {2: "H", 4: "I"}[offset_size]
+    count = len(files)
+
+    head = bytearray(struct.pack(">I", 0x41465332))
+    head += bytes((2, offset_size, cue_id_size, 0))
+    head += struct.pack("<IHH", count, alignment, mix_key)
+    head += struct.pack("<" + id_fmt * count, *(cue_id for cue_id, _ in files))
+    table_pos = len(head)
+    head_end = table_pos + offset_size * (count + 1)
+
+    body = bytearray()
+    offsets = []
+    pos = head_end
+    for _, payload in files:
+        offsets.append(pos)
+        aligned = _align(pos, alignment)
+        body += bytes(aligned - pos)
+        body += payload
+        pos = aligned + len(payload)
+    offsets.append(pos)
+
+    head += struct.pack("<" + off_fmt * (count + 1), *offsets)
+    return bytes(head + body)
+
+
+def _mask_tag(tag):
+    return bytes(b | 0x80 if b else 0 for b in tag)
+
+
+# build_hca's comp section gives the first channel this many scalefactors.
+_SCALEFACTORS = 128
+
+
+def _block_payload(rng, size):
+    """ Random block contents (after the sync word), except that the first
+        channel's scalefactors are valid, so acb.hca.check_block passes. """
+    bits, nbits = rng.getrandbits(16), 16 # noise level, evaluation boundary
+    value = rng.randrange(64)
+    bits, nbits = (bits << 9) | (3 << 6) | value, nbits + 9 # 3-bit deltas
+    for _ in range(_SCALEFACTORS - 1):
+        delta = rng.randrange(max(0, 3 - value), min(7, 67 - value))
+        value += delta - 3
+        bits, nbits = (bits << 3) | delta, nbits + 3
+
+    head = -(-nbits // 8)
+    if head > size:
+        return rng.getrandbits(8 * size).to_bytes(size, "little")
+    bits <<= head * 8 - nbits
+    return bits.to_bytes(head, "big") + rng.getrandbits(8 * (size - head)).to_bytes(size - head, "little")
+
+
+def build_hca(block_count=16, block_size=0x200, channels=2, sample_rate=48000,
+              keyspec=None, mix_key=None, masked=True, seed=0, loop=None):
+    """ Build an HCA file. If keyspec is given, the blocks are encrypted
+        with cipher type 56 using that key (and mix_key, if any). """
+    rng = random.Random(seed)
+
+    sections = bytearray()
+    sections += b"fmt\x00" + struct.pack(">B", channels) + sample_rate.to_bytes(3, "big")
+    sections += struct.pack(">IHH", block_count, 0x80, 0x226)
+    sections += b"comp" + struct.pack(">H", block_size) + bytes((1, 15, 1, 1, 0, 128, 0, 0, 0, 0))
+    if loop:
+        sections += b"loop" + struct.pack(">IIHH", loop[0], loop[1], 0x80, 0x200)
+    sections += b"ciph" + struct.pack(">H", 56 if keyspec else 0)
+
+    header_size = 8 + len(sections) + 4 + 2
+    header_size = _align(header_size, 0x20)
+    header = bytearray(b"HCA\x00" + struct.pack(">HH", 0x0200, header_size))
+    header += sections
+    header += b"pad\x00"
+    header += bytes(header_size - 2 - len(header))
+
+    if masked:
+        pos = 0
+        while pos < header_size - 2:
+            tag = bytes(header[pos:pos + 4])
+            header[pos:pos + 4] = _mask_tag(tag)
+            if tag == b"pad\x00":
+                break
+            pos += {b"HCA\x00": 8, b"fmt\x00": 16, b"comp": 16, b"loop": 16, b"ciph": 6}[tag]
+    header += checksum(bytes(header)).to_bytes(2, "big")
+
+    inverse = None
+    if keyspec:
+        table = DisarmContext(keyspec, mix_key).key_table_2
+        inverse = bytearray(256)
+        for i, v in enumerate(table):
+            inverse[v] = i
+
+    blocks = bytearray()
+    for _ in range(block_count):
+        block = bytearray(b"\xff\xff")
+        block += _block_payload(rng, block_size - 4)
+        if inverse:
+            block = block.translate(inverse)
+        block += checksum(bytes(block)).to_bytes(2, "big")
+        blocks += block
+
+    return bytes(header + blocks)
+
+
+track_spec_t = T("track_spec_t", ("name", "payload", "enc_type", "is_stream"))
+
+
+def build_acb(tracks, mix_key=0, stream_mix_key=0, encoding="utf-8", alignment=32):
+    """ Build an ACB (and the matching external AWB, if any tracks are
+        streamed). tracks is a list of track_spec_t.
+        Returns (acb_bytes, awb_bytes_or_None). """
+    memory = [(i, t.payload) for i, t in enumerate(tracks) if not t.is_stream]
+    stream = [(i, t.payload) for i, t in enumerate(tracks) if t.is_stream]
+    memory_ids = {idx: n for n, (idx, _) in enumerate(memory)}
+    stream_ids = {idx: n for n, (idx, _) in enumerate(stream)}
+
+    n = len(tracks)
+    cue_table = build_utf("Cue", [
+        column_t("CueId", utf.COLUMN_TYPE_4BYTE, list(range(n))),
+        column_t("ReferenceType", utf.COLUMN_TYPE_1BYTE, 3),
+        column_t("ReferenceIndex", utf.COLUMN_TYPE_2BYTE, list(range(n))),
+        column_t("UserData", utf.COLUMN_TYPE_STRING, ""),
+        column_t("Length", utf.COLUMN_TYPE_4BYTE, [1000] * n),
+    ], n, encoding)
+    name_table = build_utf("CueName", [
+        column_t("CueName", utf.COLUMN_TYPE_STRING, [t.name for t in tracks]),
+        column_t("CueIndex", utf.COLUMN_TYPE_2BYTE, list(range(n))),
+    ], n, encoding)
+    wave_table = build_utf("Waveform", [
+        column_t("MemoryAwbId", utf.COLUMN_TYPE_2BYTE,
+            [memory_ids.get(i, 0xffff) for i in range(n)]),
+        column_t("EncodeType", utf.COLUMN_TYPE_1BYTE, [t.enc_type for t in tracks]),
+        column_t("Streaming", utf.COLUMN_TYPE_1BYTE, [int(t.is_stream) for t in tracks]),
+        column_t("NumChannels", utf.COLUMN_TYPE_1BYTE, 2),
+        column_t("StreamAwbId", utf.COLUMN_TYPE_2BYTE,
+            [stream_ids.get(i, 0xffff) for i in range(n)]),
+    ], n, encoding)
+    synth_table = build_utf("Synth", [
+        column_t("Type", utf.COLUMN_TYPE_1BYTE, 0),
+        column_t("ReferenceItems", utf.COLUMN_TYPE_DATA,
+            [struct.pack(">HH", 1, i) for i in range(n)]),
+    ], n, encoding)
+
+    awb = build_afs2([(memory_ids[i], p) for i, p in memory], alignment, mix_key) if memory else b""
+    ext = build_afs2([(stream_ids[i], p) for i, p in stream], alignment, stream_mix_key) if stream else None
+
+    acb = build_utf("Header", [
+        column_t("FileIdentifier", utf.COLUMN_TYPE_4BYTE, [0]),
+        column_t("Name", utf.COLUMN_TYPE_STRING, ["synthetic"]),
+        column_t("CueTable", utf.COLUMN_TYPE_DATA, [cue_table]),
+        column_t("CueNameTable", utf.COLUMN_TYPE_DATA, [name_table]),
+        column_t("WaveformTable", utf.COLUMN_TYPE_DATA, [wave_table]),
+        column_t("SynthTable", utf.COLUMN_TYPE_DATA, [synth_table]),
+        column_t("AwbFile", utf.COLUMN_TYPE_DATA, [awb]),
+    ], 1, encoding)
+    return acb, ext
+
+
+def make_tracks(count, block_count=16, block_size=0x200, keyspec=None, mix_key=None,
+                stream_mix_key=None, streamed_every=2, seed=0):
+    """ Build a list of HCA track_spec_t. Every streamed_every-th track is
+        put in the external AWB (0 to disable). """
+    tracks = []
+    for i in range(count):
+        is_stream = bool(streamed_every) and i % streamed_every == streamed_every - 1
+        payload = build_hca(block_count, block_size, keyspec=keyspec,
+            mix_key=stream_mix_key if is_stream else mix_key, seed=seed + i)
+        tracks.append(track_spec_t("track_{0:04d}".format(i), payload, 2, is_stream))
+    return tracks
@@ -0,0 +1,369 @@
+import gc
+import gzip
+import io
+import json
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import synth
+from acb import utf
+from acb.acb import ACBFile, AFSArchive, Uninitialized, extract_acb
+from acb.keyring import Keyring, detect_key, load_keyring
+from acb.stats import Stats
+
+KEY = "0x1234567890abcdef"
+
+def make_acb(count=4, **kwargs):
+    tracks = synth.make_tracks(count, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222, **kwargs)
+    return synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+
+def plain_hca(seed):
+    return synth.build_hca(4, 0x100, masked=False, seed=seed)
+
+def test_lazy_table_matches_eager():
+    acb, _ = make_acb()
+    header = utf.UTFTable(io.BytesIO(acb))
+    for name in ("CueTable", "CueNameTable", "WaveformTable", "SynthTable"):
+        eager = utf.UTFTable(io.BytesIO(header.rows[0][name]))
+        lazy = utf.UTFTable(header.rows[0][name], lazy=True)
+        assert [dict(row) for row in lazy.rows] == eager.rows
+
+def test_afs2_duplicate_cue_ids():
+    archive = AFSArchive(synth.build_afs2([(5, b"first"), (3, b"three"), (5, b"second"), (1, b"one")]))
+    assert archive.file_data_for_cue_id(5) == b"first"
+
+    entries = archive.entries_for_cue_ids([1, 5, 3, 5, 1])
+    assert [e.cue_id for e in entries] == [5, 3, 1]
+    assert entries == sorted(entries, key=lambda e: e.offset)
+    assert [bytes(data) for _, data in archive.file_data_for_cue_ids([1, 5])] == [b"first", b"one"]
+
+    with pytest.raises(ValueError):
+        archive.entries_for_cue_ids([1, 2])
+
+def test_get_track_data():
+    acb, awb = make_acb()
+    with ACBFile(acb, awb, hca_keys=KEY) as f:
+        for i, track in enumerate(f.track_list.tracks):
+            assert bytes(f.get_track_data(track)) == plain_hca(i)
+            assert b"".join(f.stream_track_data(track, blocks_per_chunk=1)) == plain_hca(i)
+
+def test_extract_acb(tmp_path):
+    acb, awb = make_acb()
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+    out = tmp_path / "out"
+    out.mkdir()
+
+    extract_acb(str(tmp_path / "x.acb"), str(out), str(tmp_path / "x.awb"), hca_keys=KEY, workers=2)
+    assert sorted(os.listdir(out)) == ["track_{0:04d}.hca".format(i) for i in range(4)]
+    for i in range(4):
+        assert (out / "track_{0:04d}.hca".format(i)).read_bytes() == plain_hca(i)
+
+def test_extract_stats(tmp_path):
+    acb, awb = make_acb()
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+
+    stats = extract_acb(str(tmp_path / "x.acb"), str(tmp_path), str(tmp_path / "x.awb"), hca_keys=KEY,
+        stats=Stats())
+    result = json.loads(stats.to_json())
+    assert set(result["phases"]) == {"parse", "index", "key_table", "read", "disarm", "write"}
+    assert result["phases"]["disarm"]["bytes"] == sum(len(plain_hca(i)) for i in range(4))
+    assert sorted(t["name"] for t in result["tracks"]) == ["track_{0:04d}".format(i) for i in range(4)]
+    assert all(t["disarm"] == result["disarm_backend"] for t in result["tracks"])
+
+def test_schema_cache():
+    def table(names):
+        return synth.build_utf("T", [synth.column_t(n, utf.COLUMN_TYPE_2BYTE, [1, 2]) for n in names])
+
+    first = utf.UTFTable(table(["Aa", "Bb"]))
+    before = utf.schema_cache_info()
+    again = utf.UTFTable(table(["Aa", "Bb"]))
+    assert utf.schema_cache_info().hits == before.hits + 1
+    assert again.schema is first.schema
+
+    # Same schema bytes, but the names in the string table differ.
+    other = utf.UTFTable(table(["Cc", "Dd"]))
+    assert other.rows == [{"Cc": 1, "Dd": 1}, {"Cc": 2, "Dd": 2}]
+
+def test_string_table_decoding():
+    names = ["トラック{0}".format(i) if i % 3 else "track{0}".format(i) for i in range(40)]
+    raw = synth.build_utf("CueName", [
+        synth.column_t("CueName", utf.COLUMN_TYPE_STRING, names + names[:5]),
+        synth.column_t("CueIndex", utf.COLUMN_TYPE_2BYTE, list(range(45))),
+    ], encoding="sjis")
+
+    assert [row["CueName"] for row in utf.UTFTable(io.BytesIO(raw)).rows] == names + names[:5]
+    assert utf.UTFTable(raw, lazy=True).column("CueName") == names + names[:5]
+
+def test_metadata_only(tmp_path):
+    acb, awb = make_acb()
+    (tmp_path / "x.acb").write_bytes(acb)
+
+    with ACBFile(str(tmp_path / "x.acb"), metadata_only=True) as f:
+        assert [t.name for t in f.track_list.tracks] == ["track_{0:04d}".format(i) for i in range(4)]
+        with pytest.raises(ValueError):
+            f.get_track_data(f.track_list.tracks[0])
+
+def test_sidecar_index(tmp_path):
+    acb, awb = make_acb()
+    acb_path, awb_path = str(tmp_path / "x.acb"), str(tmp_path / "x.awb")
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+    index = str(tmp_path / "x.index.json")
+
+    with ACBFile(acb_path, awb_path, hca_keys=KEY, index=index) as f:
+        assert not f.archive_records
+        tracks = f.track_list.tracks
+
+    with ACBFile(acb_path, awb_path, hca_keys=KEY, index=index) as f:
+        assert f.archive_records
+        assert f.track_list.tracks == tracks
+        for i, track in enumerate(tracks):
+            assert bytes(f.get_track_data(track)) == plain_hca(i)
+
+    # Changing the AWB invalidates the index.
+    os.utime(awb_path, ns=(0, 0))
+    with ACBFile(acb_path, awb_path, hca_keys=KEY, index=index) as f:
+        assert not f.archive_records
+
+def test_concurrent_reads(tmp_path):
+    acb, awb = make_acb(8)
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+    expect = [plain_hca(i) for i in range(8)]
+
+    with ACBFile(str(tmp_path / "x.acb"), str(tmp_path / "x.awb"), hca_keys=KEY) as f:
+        if hasattr(os, "pread"):
+            # pread readers have no shared cursor, so the archives don't need a lock.
+            assert f.embedded_awb.lock is None and f.external_awb.lock is None
+
+        def read(n):
+            track = f.track_list.tracks[n % 8]
+            return bytes(f.get_track_data(track)) == expect[n % 8]
+
+        with ThreadPoolExecutor(8) as pool:
+            assert all(pool.map(read, range(200)))
+
+def test_probe_tracks():
+    tracks = synth.make_tracks(2, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+    tracks.append(synth.track_spec_t("looped", synth.build_hca(8, 0x100, channels=1, sample_rate=44100,
+        loop=(1, 6)), 2, False))
+    tracks.append(synth.track_spec_t("adx", b"\x80\x00" + bytes(62), 0, False))
+    acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+
+    with ACBFile(acb, awb) as f:
+        probes = f.probe_tracks()
+    assert [p.track.name for p in probes] == ["track_0000", "track_0001", "looped", "adx"]
+
+    info = probes[0].hca
+    assert (info.channels, info.sample_rate, info.block_count, info.block_size, info.ciph_type) == (2, 48000, 4, 0x100, 56)
+    assert info.loop is None
+    assert info.samples == 4 * 1024 - 0x80 - 0x226
+    assert probes[1].hca.ciph_type == 56
+
+    looped = probes[2].hca
+    assert (looped.channels, looped.sample_rate, looped.ciph_type) == (1, 44100, 0)
+    assert looped.loop[:2] == (1, 6)
+    assert looped.duration == pytest.approx((8 * 1024 - 0x80 - 0x226) / 44100)
+    assert probes[3].hca is None
+
+    # No keys are needed, so none are looked for.
+    keyring = Keyring([KEY])
+    keyring.detect = lambda archive: pytest.fail("probe_tracks looked for a key")
+    with ACBFile(acb, awb, keyring=keyring) as f:
+        assert f.probe_tracks() == probes
+        assert f.detected_keys == {}
+        assert f.embedded_disarm is Uninitialized and f.external_disarm is Uninitialized
+
+def test_keyring(tmp_path):
+    acb, awb = make_acb()
+    (tmp_path / "keys.txt").write_text("# title A\n0x1111111111111111\n\n0x90abcdef,0x12345678  # title B\n")
+    keyring = load_keyring(str(tmp_path / "keys.txt"))
+    assert keyring.keys == ["0x1111111111111111", "0x90abcdef,0x12345678"]
+
+    with ACBFile(acb, awb, keyring=keyring) as f:
+        for i, track in enumerate(f.track_list.tracks):
+            assert bytes(f.get_track_data(track)) == plain_hca(i)
+        assert f.detected_keys == {"embedded_awb": "0x90abcdef,0x12345678", "external_awb": "0x90abcdef,0x12345678"}
+    # The key that matched is tried first next time.
+    assert keyring.keys[0] == "0x90abcdef,0x12345678"
+
+    with ACBFile(acb, awb, keyring=Keyring(["0x1111111111111111"])) as f:
+        assert bytes(f.get_track_data(f.track_list.tracks[0])) == synth.build_hca(4, 0x100, keyspec=KEY, mix_key=0x1111)
+        assert f.detected_keys["embedded_awb"] is None
+
+    # Few blocks to go on: a wrong key passing them all by chance mustn't win.
+    wrong = ["0x{0:016x}".format(random.Random(i).getrandbits(64)) for i in range(30)]
+    archive = AFSArchive(synth.build_afs2([(0, synth.build_hca(2, 0x100, keyspec=KEY))]))
+    assert detect_key(archive, wrong + [KEY]) is None
+    archive = AFSArchive(synth.build_afs2([(i, synth.build_hca(16, 0x100, keyspec=KEY, seed=i)) for i in range(4)]))
+    assert detect_key(archive, wrong[:11] + wrong[12:] + [KEY]) == KEY
+    # More to go on, but wrong[11] still passes every block: too close to call.
+    assert detect_key(archive, wrong + [KEY]) is None
+    # Nothing encrypted to check.
+    archive = AFSArchive(synth.build_afs2([(0, synth.build_hca(2, 0x100))]))
+    assert detect_key(archive, [KEY]) is None
+
+    (tmp_path / "bad.txt").write_text("0x12\nnot a key\n")
+    with pytest.raises(ValueError, match="bad.txt:2"):
+        load_keyring(str(tmp_path / "bad.txt"))
+
+def test_mmap(tmp_path):
+    acb, awb = make_acb()
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+
+    with ACBFile(str(tmp_path / "x.acb"), str(tmp_path / "x.awb"), hca_keys=KEY) as f:
+        expect = [(bytes(f.get_track_data(t)), bytes(f.get_track_data(t, disarm=False))) for t in f.track_list.tracks]
+
+    # Closing mustn't depend on the garbage collector to drop views of the maps.
+    gc.disable()
+    try:
+        check_mmap(tmp_path, expect)
+    finally:
+        gc.enable()
+
+def check_mmap(tmp_path, expect):
+    f = ACBFile(str(tmp_path / "x.acb"), str(tmp_path / "x.awb"), hca_keys=KEY, use_mmap=True)
+    maps = (f.acb_map, f.awb_map)
+    assert all(m is not None for m in maps)
+    for track, (plain, raw) in zip(f.track_list.tracks, expect):
+        assert bytes(f.get_track_data(track)) == plain
+        view = f.get_track_data(track, disarm=False)
+        assert isinstance(view, memoryview) and view.readonly and bytes(view) == raw
+        view.release()
+
+    handles = (f.acb_handle, f.awb_handle)
+    f.close()
+    assert f.acb_map is None and f.awb_map is None
+    assert all(m.closed for m in maps)
+    assert all(h.closed for h in handles)
+
+def test_columns_match_rows():
+    numpy = pytest.importorskip("numpy")
+    acb, _ = make_acb(20)
+    header = utf.UTFTable(acb)
+    for name in ("CueTable", "CueNameTable", "WaveformTable", "SynthTable"):
+        table = utf.UTFTable(header.rows[0][name])
+        columns = table.columns()
+        assert set(columns) == set(table.rows[0])
+        for key, values in columns.items():
+            expect = [row[key] for row in table.rows]
+            if numpy.ndim(values) == 0:
+                assert [values] * len(expect) == expect
+            elif values.dtype.names:
+                assert [bytes(table.src.bytes(int(size), at=int(offset))) for offset, size in values] == expect
+            else:
+                assert values.tolist() == expect
+
+    # Data columns are left where they are.
+    spans = header.columns()["AwbFile"]
+    assert tuple(int(x) for x in spans[0]) == header.data_span("AwbFile")
+
+def extract_plain(tmp_path, tracks):
+    acb, awb = synth.build_acb(tracks)
+    (tmp_path / "x.acb").write_bytes(acb)
+    (tmp_path / "x.awb").write_bytes(awb)
+    out = tmp_path / "out"
+    out.mkdir(exist_ok=True)
+    extract_acb(str(tmp_path / "x.acb"), str(out), str(tmp_path / "x.awb"))
+    return [(out / "track_{0:04d}.hca".format(i)).read_bytes() for i in range(len(tracks))]
+
+kernel_copy = pytest.mark.skipif(not hasattr(os, "copy_file_range") and not hasattr(os, "sendfile"),
+    reason="no copy_file_range or sendfile")
+
+@kernel_copy
+def test_extract_without_keys(tmp_path, monkeypatch):
+    tracks = synth.make_tracks(4, 4, 0x100, keyspec=KEY)
+    calls = []
+    for name in ("copy_file_range", "sendfile"):
+        real = getattr(os, name, None)
+        if real is not None:
+            def spy(*args, real=real, name=name):
+                calls.append(name)
+                return real(*args)
+            monkeypatch.setattr(os, name, spy)
+
+    # Nothing to decrypt, so the tracks are copied as they are by the kernel.
+    assert extract_plain(tmp_path, tracks) == [t.payload for t in tracks]
+    assert calls
+
+@kernel_copy
+def test_extract_kernel_copy_fallback(tmp_path, monkeypatch):
+    tracks = synth.make_tracks(4, 4, 0x100, keyspec=KEY)
+
+    def short_copy(src, dst, count, offset, *args):
+        # Copies a little, then gives up.
+        if os.lseek(dst, 0, os.SEEK_CUR) > 0:
+            return 0
+        os.lseek(src, offset, os.SEEK_SET)
+        return os.write(dst, os.read(src, min(count, 100)))
+
+    def broken(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(os, "copy_file_range", short_copy, raising=False)
+    monkeypatch.setattr(os, "sendfile", broken, raising=False)
+    assert extract_plain(tmp_path, tracks) == [t.payload for t in tracks]
+
+    monkeypatch.setattr(os, "copy_file_range", broken)
+    assert extract_plain(tmp_path, tracks) == [t.payload for t in tracks]
+
+needs_unraisablehook = pytest.mark.skipif(sys.version_info < (3, 8), reason="needs sys.unraisablehook")
+
+def bad_arguments_are_quiet(monkeypatch, *args, **kwargs):
+    # A constructor that raises mustn't make __del__ complain afterwards.
+    unraisable = []
+    monkeypatch.setattr(sys, "unraisablehook", unraisable.append)
+    with pytest.raises(ValueError):
+        ACBFile(*args, **kwargs)
+    gc.collect()
+    assert unraisable == []
+
+@needs_unraisablehook
+def test_bad_index_argument(monkeypatch, tmp_path):
+    acb, _ = make_acb()
+    bad_arguments_are_quiet(monkeypatch, acb, index=str(tmp_path))
+
+def test_wrapped_stream(tmp_path):
+    # GzipFile has a fileno(), but it's the compressed file's: reading it
+    # directly (pread, mmap, copy_file_range) would see the wrong bytes.
+    tracks = synth.make_tracks(2, 4, 0x100, keyspec=KEY, streamed_every=0)
+    acb, _ = synth.build_acb(tracks)
+    with gzip.open(str(tmp_path / "x.acb.gz"), "wb") as f:
+        f.write(acb)
+
+    with gzip.open(str(tmp_path / "x.acb.gz"), "rb") as gz:
+        assert utf.os_file_fd(gz) is None
+        assert type(utf.make_reader(gz)) is utf.R
+        with ACBFile(gz, use_mmap=True) as f:
+            assert f.acb_map is None
+            assert [t.name for t in f.track_list.tracks] == ["track_0000", "track_0001"]
+            for i, track in enumerate(f.track_list.tracks):
+                assert bytes(f.get_track_data(track)) == tracks[i].payload
+                with open(str(tmp_path / "out.hca"), "wb") as out:
+                    f.write_track(track, out)
+                assert (tmp_path / "out.hca").read_bytes() == tracks[i].payload
+
+@needs_unraisablehook
+def test_bad_keyring_argument(monkeypatch, tmp_path):
+    acb, awb = make_acb()
+    bad_arguments_are_quiet(monkeypatch, acb, awb, hca_keys=KEY, keyring=Keyring([KEY]))
+    (tmp_path / "bad.txt").write_text("not a key\n")
+    bad_arguments_are_quiet(monkeypatch, acb, awb, keyring=str(tmp_path / "bad.txt"))
+
+@kernel_copy
+def test_write_track_truncated(tmp_path):
+    tracks = synth.make_tracks(1, 4, 0x100, keyspec=KEY, streamed_every=1)
+    acb, awb = synth.build_acb(tracks)
+    (tmp_path / "x.awb").write_bytes(awb[:-0x80])
+
+    with ACBFile(acb, str(tmp_path / "x.awb")) as f, open(str(tmp_path / "out.hca"), "wb") as out:
+        written = f.write_track(f.track_list.tracks[0], out)
+    assert written == len(tracks[0].payload) - 0x80
+    assert (tmp_path / "out.hca").read_bytes() == tracks[0].payload[:-0x80]
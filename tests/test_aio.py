@@ -0,0 +1,43 @@
+import asyncio
+
+import synth
+from acb.acb import ACBFile
+from acb.aio import AsyncACBFile
+
+KEY = "0x1234567890abcdef"
+
+def test_async_acb_file():
+    tracks = synth.make_tracks(6, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+    acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+    expect = [synth.build_hca(4, 0x100, masked=False, seed=i) for i in range(6)]
+
+    async def run():
+        async with await AsyncACBFile.open(acb, awb, hca_keys=KEY, concurrency=2) as f:
+            assert [t.name for t in f.track_list.tracks] == ["track_{0:04d}".format(i) for i in range(6)]
+
+            got = [(track.name, bytes(data)) async for track, data in f.iter_tracks()]
+            assert got == [(t.name, e) for t, e in zip(f.track_list.tracks, expect)]
+
+            track = f.track_list.tracks[3]
+            assert bytes(await f.get_track_data(track)) == expect[3]
+            assert bytes(await f.get_track_data(track, disarm=False)) == tracks[3].payload
+            chunks = [bytes(c) async for c in f.stream_track_data(track, blocks_per_chunk=1)]
+            assert len(chunks) == 5 and b"".join(chunks) == expect[3]
+        return f
+
+    f = asyncio.run(run())
+    assert f.acb.closed
+
+def test_construct_outside_loop():
+    tracks = synth.make_tracks(2, 4, 0x100, streamed_every=0)
+    acb, _ = synth.build_acb(tracks)
+    f = AsyncACBFile(ACBFile(acb))
+
+    async def read():
+        return [bytes(data) async for _, data in f.iter_tracks()]
+
+    # Each asyncio.run has a loop of its own.
+    for _ in range(2):
+        assert asyncio.run(read()) == [t.payload for t in tracks]
+    asyncio.run(f.close())
+    assert f.acb.closed
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import synth
+from acb.batch import extract_tree, iter_acb_files, main, target_dir_for
+
+KEY = "0x1234567890abcdef"
+
+def write_tree(root):
+    tracks = synth.make_tracks(2, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+    acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+    for name in (("a", "bgm"), ("a", "b", "se"), ("c", "voice")):
+        path = os.path.join(root, *name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".acb", "wb") as f:
+            f.write(acb)
+        with open(path + ".awb", "wb") as f:
+            f.write(awb)
+    with open(os.path.join(root, "a", "notes.txt"), "w") as f:
+        f.write("not an acb")
+
+def read_tree(root):
+    ret = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            with open(os.path.join(dirpath, name), "rb") as f:
+                ret[os.path.relpath(os.path.join(dirpath, name), root)] = f.read()
+    return ret
+
+def test_iter_acb_files(tmp_path):
+    root = str(tmp_path)
+    write_tree(root)
+    a = os.path.join(root, "a")
+
+    assert list(iter_acb_files([a])) == [(os.path.join(a, "bgm.acb"), a), (os.path.join(a, "b", "se.acb"), a)]
+    # Files named directly or through a glob are relative to their own
+    # directory, and nothing is listed twice.
+    voice = os.path.join(root, "c", "voice.acb")
+    assert list(iter_acb_files([voice, os.path.join(root, "*", "*.acb"), a])) == [
+        (voice, os.path.dirname(voice)),
+        (os.path.join(a, "bgm.acb"), a),
+        (os.path.join(a, "b", "se.acb"), a),
+    ]
+    assert list(iter_acb_files([os.path.join(root, "missing.acb")])) == []
+
+def test_target_dir_for():
+    assert target_dir_for("in/a/b/se.acb", "in/a", "out") == os.path.join("out", "b", "se")
+    assert target_dir_for("in/a/bgm.acb", "in/a", "out") == os.path.join("out", "bgm")
+    assert target_dir_for("in/a/bgm.acb", "in/a", None) == os.path.join("in/a", "bgm")
+
+def test_extract_tree_errors(tmp_path):
+    root = str(tmp_path / "in")
+    write_tree(root)
+    with open(os.path.join(root, "a", "broken.acb"), "wb") as f:
+        f.write(b"@UTF" + bytes(60))
+
+    seen = []
+    results = extract_tree([root], str(tmp_path / "out"), hca_keys=KEY, jobs=2,
+        progress=lambda done, total, result: seen.append((done, total)))
+    assert seen == [(n, 4) for n in range(1, 5)]
+
+    errors = {os.path.relpath(r.acb_path, root): r.error for r in results}
+    assert [k for k, v in errors.items() if v] == [os.path.join("a", "broken.acb")]
+    assert sorted(read_tree(str(tmp_path / "out"))) == sorted(os.path.join(*d, "track_{0:04d}.hca".format(i))
+        for d in (("a", "bgm"), ("a", "b", "se"), ("c", "voice")) for i in range(2))
+
+def test_main_jobs(tmp_path, capsys):
+    root = str(tmp_path / "in")
+    write_tree(root)
+    with open(os.path.join(root, "c", "broken.acb"), "wb") as f:
+        f.write(b"not an acb")
+
+    outputs = []
+    for jobs in ("1", "3"):
+        out = str(tmp_path / ("out" + jobs))
+        assert main(["-q", "-j", jobs, "--disarm-with", KEY, "-o", out, root]) == 1
+        outputs.append(read_tree(out))
+
+        err = capsys.readouterr().err
+        assert "error: {0}".format(os.path.join(root, "c", "broken.acb")) in err
+        assert "4 files, 6 tracks" in err and "1 failed" in err
+
+    assert outputs[0] == outputs[1]
+    assert outputs[0][os.path.join("a", "bgm", "track_0001.hca")] == synth.build_hca(4, 0x100, masked=False, seed=1)
+
+def test_missing_file(tmp_path, capsys):
+    root = str(tmp_path / "in")
+    write_tree(root)
+    gone = os.path.join(root, "a", "gone.acb")
+    try:
+        os.symlink(os.path.join(root, "nowhere.acb"), gone)
+    except (OSError, NotImplementedError):
+        pytest.skip("symlinks aren't supported here")
+
+    # Walked, but not there by the time a worker gets to it.
+    assert main(["-q", "-j", "2", "-o", str(tmp_path / "out"), root]) == 1
+    err = capsys.readouterr().err
+    assert "error: {0}: FileNotFoundError".format(gone) in err
+    assert "4 files, 6 tracks" in err and "1 failed" in err
@@ -1,5 +1,9 @@
 import binascii
 import hashlib
+import random
+
+import pytest
+
 from acb import disarm
 disarm._acb_speedup = None
 
@@ -114,3 +118,103 @@ def test_full_disarm():
     context.disarm(vec4)
     hash = hashlib.sha256(vec4).hexdigest()
     assert hash == "ac080f61f6608d899c39ef09742cf7b5665ecb5ff616c2b421957bf1cd476869"
+
+def test_python_fallback_matches_speedup():
+    rng = random.Random(1234)
+    context = disarm.DisarmContext("0x30dba4b4a1b6e3bf")
+
+    for size in (0, 1, 2, 3, 0x7f, 0x100, 0x3ff):
+        buf = bytes(rng.getrandbits(8) for _ in range(size))
+        disarm._acb_speedup = None
+        assert disarm.checksum(buf) == _acb_speedup.checksum_fast(buf)
+
+    for block_size in (0x100, 0x2ab):
+        blocks = bytes(rng.getrandbits(8) for _ in range(block_size * 5))
+
+        disarm._acb_speedup = _acb_speedup
+        fast = bytearray(blocks)
+        context.disarm_blocks(fast, 0, 5, block_size, 56)
+
+        disarm._acb_speedup = None
+        slow = bytearray(blocks)
+        context.disarm_blocks(slow, 0, 5, block_size, 56)
+        assert fast == slow
+
+def test_key_table_speedup():
+    rng = random.Random(5678)
+    keys = [(0, 0), (0, 1), (0xffffffff, 0xffffffff)]
+    keys += [(rng.getrandbits(32), rng.getrandbits(32)) for _ in range(100)]
+
+    for keya, keyb in keys:
+        table = _acb_speedup.derive_key_table_fast(keya, keyb)
+        assert table == bytes(disarm._derive_key_table_py(keya, keyb))
+
+def test_backends_match():
+    rng = random.Random(4321)
+    context = disarm.DisarmContext("0x30dba4b4a1b6e3bf")
+    backends = [b for b in ("c", "numpy", "python") if b != "numpy" or disarm.numpy is not None]
+
+    disarm._acb_speedup = _acb_speedup
+    try:
+        # (block size, blocks claimed, bytes actually there after the offset)
+        cases = [(0x100, 5, 0x500), (0x2ab, 3, 0x2ab * 3), (0x400, 1, 0x400),
+            # Truncated: a partial last block, just one byte of it, or none.
+            (0x100, 5, 0x380), (0x2ab, 3, 0x2ab + 1), (0x100, 4, 0x200), (0x100, 2, 0)]
+        for block_size, count, size in cases:
+            blocks = bytes(rng.getrandbits(8) for _ in range(size + 7))
+            results = []
+            for backend in backends:
+                disarm.set_disarm_backend(backend)
+                assert disarm.disarm_backend() == backend
+                buf = bytearray(blocks)
+                context.disarm_blocks(buf, 7, count, block_size, 56)
+                results.append(buf)
+            assert all(r == results[0] for r in results)
+    finally:
+        disarm.set_disarm_backend("auto")
+        disarm._acb_speedup = None
+
+def test_truncated_file():
+    import synth
+    keyspec = "0x30dba4b4a1b6e3bf"
+    full = synth.build_hca(4, 0x100, keyspec=keyspec)
+    plain = synth.build_hca(4, 0x100, masked=False)
+    header_size = len(full) - 4 * 0x100
+    backends = [b for b in ("c", "numpy", "python") if b != "numpy" or disarm.numpy is not None]
+
+    disarm._acb_speedup = _acb_speedup
+    try:
+        for cut in (2 * 0x100, 2 * 0x100 + 1, 2 * 0x100 + 0x80, 0x100 - 3):
+            results = []
+            for backend in backends:
+                disarm.set_disarm_backend(backend)
+                buf = bytearray(full[:header_size + cut])
+                disarm.DisarmContext(keyspec).disarm(buf)
+                results.append(buf)
+            assert all(r == results[0] for r in results)
+            # The whole blocks that are there come out as usual.
+            whole = header_size + cut // 0x100 * 0x100
+            assert results[0][:whole] == plain[:whole]
+    finally:
+        disarm.set_disarm_backend("auto")
+        disarm._acb_speedup = None
+
+CHECKSUM_SIZES = list(range(301)) + [0x3ff, 0x400, 0x1001, 0x10000 + 3]
+
+@pytest.mark.parametrize("impl", ["bytewise", "slice8", "clmul"])
+def test_checksum_implementations(impl):
+    try:
+        _acb_speedup.checksum_with(b"", impl)
+    except ValueError:
+        pytest.skip("{0} isn't available on this host".format(impl))
+
+    rng = random.Random(impl)
+    for size in CHECKSUM_SIZES:
+        buf = bytes(rng.getrandbits(8) for _ in range(size))
+        assert _acb_speedup.checksum_with(buf, impl) == disarm._checksum_py(buf), size
+
+    # Data that doesn't start on an aligned address.
+    buf = bytes(rng.getrandbits(8) for _ in range(0x1008))
+    for offset in range(1, 8):
+        view = memoryview(buf)[offset:]
+        assert _acb_speedup.checksum_with(view, impl) == disarm._checksum_py(view), offset
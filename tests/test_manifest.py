@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+import synth
+from acb.acb import extract_acb, name_gen_default
+from acb.manifest import MANIFEST_NAME
+from acb.stats import Stats
+
+KEY = "0x1234567890abcdef"
+NAMES = ["track_{0:04d}.hca".format(i) for i in range(4)]
+
+@pytest.fixture
+def files(tmp_path):
+    def write(tracks=None):
+        if tracks is None:
+            tracks = synth.make_tracks(4, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+        acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+        (tmp_path / "x.acb").write_bytes(acb)
+        (tmp_path / "x.awb").write_bytes(awb)
+        return tracks
+
+    (tmp_path / "out").mkdir()
+    write()
+    return tmp_path, write
+
+def extract(tmp_path, **kwargs):
+    """ Returns the files that were written, and whether any track data was read. """
+    kwargs.setdefault("hca_keys", KEY)
+    stats = extract_acb(str(tmp_path / "x.acb"), str(tmp_path / "out"), str(tmp_path / "x.awb"),
+        incremental=True, stats=Stats(), **kwargs)
+    result = json.loads(stats.to_json())
+    written = sorted(t["name"] for t in result["tracks"])
+    return written, "read" in result["phases"]
+
+def plain(i):
+    return synth.build_hca(4, 0x100, masked=False, seed=i)
+
+def test_unchanged(files):
+    tmp_path, _ = files
+    assert extract(tmp_path) == (["track_{0:04d}".format(i) for i in range(4)], True)
+    assert (tmp_path / "out" / MANIFEST_NAME).exists()
+    # Nothing changed: no track data is even read.
+    assert extract(tmp_path) == ([], False)
+    assert [(tmp_path / "out" / n).read_bytes() for n in NAMES] == [plain(i) for i in range(4)]
+
+def test_source_changed(files):
+    tmp_path, write = files
+    tracks = write()
+    extract(tmp_path)
+
+    # Same content, new mtime: the tracks are read and hashed, but not rewritten.
+    os.utime(tmp_path / "x.acb", ns=(0, 0))
+    assert extract(tmp_path) == ([], True)
+
+    # Changing one track's data only rewrites that track, embedded or streamed.
+    for i in (0, 1):
+        tracks[i] = tracks[i]._replace(payload=synth.build_hca(4, 0x100, keyspec=KEY,
+            mix_key=0x2222 if tracks[i].is_stream else 0x1111, seed=100 + i))
+        write(tracks)
+        assert extract(tmp_path) == (["track_{0:04d}".format(i)], True)
+        assert (tmp_path / "out" / NAMES[i]).read_bytes() == plain(100 + i)
+
+@pytest.mark.parametrize("options", [
+    {"hca_keys": None},
+    {"no_unmask": True},
+    {"name_gen": lambda track: "x_" + name_gen_default(track)},
+])
+def test_options_changed(files, options):
+    tmp_path, _ = files
+    extract(tmp_path)
+    written, _ = extract(tmp_path, **options)
+    assert written == ["track_{0:04d}".format(i) for i in range(4)]
+    # And the new options are remembered.
+    assert extract(tmp_path, **options) == ([], False)
+
+def test_output_changed(files):
+    tmp_path, _ = files
+    extract(tmp_path)
+
+    (tmp_path / "out" / NAMES[1]).unlink()
+    (tmp_path / "out" / NAMES[2]).write_bytes(b"edited")
+    assert extract(tmp_path)[0] == ["track_0001", "track_0002"]
+    assert [(tmp_path / "out" / n).read_bytes() for n in NAMES] == [plain(i) for i in range(4)]
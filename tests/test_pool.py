@@ -0,0 +1,49 @@
+import os
+
+import synth
+from acb.pool import ACBPool
+
+KEY = "0x1234567890abcdef"
+
+def write_acb(tmp_path, name):
+    tracks = synth.make_tracks(2, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+    acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+    (tmp_path / (name + ".acb")).write_bytes(acb)
+    (tmp_path / (name + ".awb")).write_bytes(awb)
+    return str(tmp_path / (name + ".acb"))
+
+def test_pool_lru(tmp_path):
+    a, b = write_acb(tmp_path, "a"), write_acb(tmp_path, "b")
+    pool = ACBPool(max_open=1)
+
+    with pool.lease(a, hca_keys=KEY) as first:
+        assert first.get_track_data(first.track_list.tracks[0])
+        # Evicted while leased, but only closed once it's released.
+        with pool.lease(b, hca_keys=KEY):
+            assert not first.closed
+    assert first.closed
+
+    with pool.lease(b, hca_keys=KEY) as second:
+        pass
+    # Different keys mean a different entry.
+    with pool.lease(b) as third:
+        assert third is not second
+    assert pool.info()[:4] == (1, 3, 2, 1)
+
+    # The file changing on disk makes the next lease reopen it.
+    os.utime(b, ns=(0, 0))
+    with pool.lease(b) as fourth:
+        assert fourth is not third and third.closed
+
+    pool.close()
+    assert fourth.closed
+
+def test_pool_memory_limit(tmp_path):
+    a, b = write_acb(tmp_path, "a"), write_acb(tmp_path, "b")
+    pool = ACBPool(max_open=8, max_memory=1)
+    with pool.lease(a) as first:
+        pass
+    with pool.lease(b):
+        pass
+    assert first.closed
+    assert pool.info().open == 1
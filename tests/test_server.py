@@ -0,0 +1,98 @@
+import os
+import threading
+from types import SimpleNamespace
+import urllib.error
+import urllib.request
+
+import pytest
+
+import synth
+from acb.server import ACBRequestHandler, ACBServer, etag_matches, parse_range
+
+KEY = "0x1234567890abcdef"
+
+@pytest.fixture
+def server(tmp_path):
+    tracks = synth.make_tracks(4, 4, 0x100, keyspec=KEY, mix_key=0x1111, stream_mix_key=0x2222)
+    acb, awb = synth.build_acb(tracks, mix_key=0x1111, stream_mix_key=0x2222)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "x.acb").write_bytes(acb)
+    (tmp_path / "sub" / "x.awb").write_bytes(awb)
+
+    server = ACBServer(("127.0.0.1", 0), str(tmp_path), hca_keys=KEY, max_open=1, quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def get(url, **headers):
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+
+def test_parse_range():
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=-10", 100) == (90, 100)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches(None, '"a"')
+
+def test_serve_track(server):
+    plain = synth.build_hca(4, 0x100, masked=False, seed=1)
+    with get(server + "/sub/x.acb/file/track_0001") as r:
+        assert r.read() == plain
+        etag = r.headers["ETag"]
+
+    with get(server + "/sub/x.acb/file/1", Range="bytes=16-31") as r:
+        assert r.status == 206
+        assert r.headers["Content-Range"] == "bytes 16-31/{0}".format(len(plain))
+        assert r.read() == plain[16:32]
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(server + "/sub/x.acb/file/track_0001", **{"If-None-Match": etag})
+    assert e.value.code == 304
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(server + "/sub/../../x.acb/file/track_0001")
+    assert e.value.code == 404
+
+def test_resolve_acb(tmp_path):
+    (tmp_path / "root").mkdir()
+    (tmp_path / "root" / "x.acb").write_bytes(b"")
+    (tmp_path / "outside.acb").write_bytes(b"")
+
+    def resolve(root, rel):
+        handler = SimpleNamespace(server=SimpleNamespace(root=os.path.realpath(root)))
+        return ACBRequestHandler.resolve_acb(handler, rel)
+
+    root = str(tmp_path / "root")
+    assert resolve(root, "x.acb") == os.path.realpath(os.path.join(root, "x.acb"))
+    assert resolve(root, "../outside.acb") is None
+    assert resolve(root, "missing.acb") is None
+
+    if os.name == "nt":
+        return
+    # Everything is under /.
+    assert resolve("/", os.path.relpath(os.path.join(root, "x.acb"), "/")) == resolve(root, "x.acb")
+    try:
+        (tmp_path / "root" / "link.acb").symlink_to(tmp_path / "outside.acb")
+    except OSError:
+        pytest.skip("symlinks aren't supported here")
+    assert resolve(root, "link.acb") is None
+
+def test_unsupported_acb(server, monkeypatch):
+    from acb import acb
+    def unsupported(self, utf):
+        raise RuntimeError("ReferenceType 1 not implemented.")
+    monkeypatch.setattr(acb.TrackList, "__init__", unsupported)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(server + "/sub/x.acb")
+    assert e.value.code == 500